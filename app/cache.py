@@ -0,0 +1,13 @@
+"""
+In-process caches for read-heavy API responses
+"""
+from cachetools import TTLCache
+
+# Encoded /graph responses keyed by (user_id, limit_nodes). Bounded so per-user
+# entries can't pile up; cleared whenever entities or relations are written.
+graph_cache: TTLCache = TTLCache(maxsize=128, ttl=60)
+
+
+def invalidate_graph_cache():
+    """Drop cached graphs after the knowledge graph changes"""
+    graph_cache.clear()
@@ -1,8 +1,8 @@
 """
 Configuration management for EchoDiary
 """
-from pydantic_settings import BaseSettings
-from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from functools import lru_cache, cached_property
 
 
 class Settings(BaseSettings):
@@ -15,12 +15,23 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8000
     
+    # CORS - the frontend is served same-origin, so this only needs the
+    # domains of any external dashboards (JSON list in the env var)
+    cors_origins: list[str] = []
+    
     # Database
     database_url: str = "sqlite+aiosqlite:///./echodiary.db"
+    db_pool_size: int = 20  # ignored for SQLite
+    db_max_overflow: int = 40
+    
+    # Redis - native protocol (redis:// or rediss://); leave empty to fall
+    # back to the Upstash REST API below
+    redis_url: str = ""
+    redis_max_connections: int = 20
     
-    # Upstash Redis
-    upstash_redis_url: str
-    upstash_redis_token: str
+    # Upstash Redis (REST)
+    upstash_redis_url: str = ""
+    upstash_redis_token: str = ""
     
     # OpenAI (Required - we use this directly)
     openai_api_key: str
@@ -33,7 +44,8 @@ class Settings(BaseSettings):
     twilio_auth_token: str = ""
     twilio_phone_number: str = ""
     twilio_webhook_base_url: str = ""
-    openai_model: str = "gpt-4-turbo-preview"
+    openai_model: str = "gpt-4-turbo-preview"  # Live conversation replies
+    openai_analysis_model: str = "gpt-4o-mini"  # Post-call analysis (background)
     openai_max_tokens: int = 100
     openai_temperature: float = 0.7
     
@@ -44,17 +56,31 @@ class Settings(BaseSettings):
     # Session Settings
     session_ttl_seconds: int = 7200  # 2 hours
     context_turns_limit: int = 3
+    local_cache_ttl_seconds: int = 60  # in-process read-through cache over Redis
     
     # Mood Scoring
     mood_negative_threshold: float = 3.0
     checkin_delay_hours: int = 24
+    # Calls where the user said fewer words than this skip the GPT analysis
+    analysis_min_words: int = 10
+    
+    # Background scheduler
+    scheduler_enabled: bool = True
+    checkin_poll_minutes: int = 15
     
     # Audio Storage
     audio_storage_path: str = "./audio_recordings"
     
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        case_sensitive=False,
+        frozen=True
+    )
+    
+    @cached_property
+    def checkin_delay_seconds(self) -> int:
+        """Check-in delay in seconds (computed once per settings instance)"""
+        return self.checkin_delay_hours * 3600
 
 
 @lru_cache()
@@ -1,17 +1,40 @@
 """
 Database configuration and session management
 """
+import logging
+from sqlalchemy import func, inspect, select, update, delete
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 from app.config import get_settings
 
 settings = get_settings()
+log = logging.getLogger(__name__)
+
+# Pool settings - SQLite gains nothing from pooling (aiosqlite runs one
+# thread per connection and writes serialize anyway), so open per session;
+# server databases get a pool sized for webhook bursts
+if settings.database_url.startswith("sqlite"):
+    pool_kwargs = {"poolclass": NullPool}
+else:
+    pool_kwargs = {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True
+    }
+    if settings.database_url.startswith("postgresql+asyncpg"):
+        # Short OLTP queries only lose time to JIT compilation
+        pool_kwargs["connect_args"] = {"server_settings": {"jit": "off"}}
 
 # Create async engine
 engine = create_async_engine(
     settings.database_url,
     echo=settings.debug,
-    future=True
+    future=True,
+    **pool_kwargs
 )
 
 # Create session factory
@@ -24,7 +47,8 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 # Base class for models
-Base = declarative_base()
+class Base(DeclarativeBase):
+    pass
 
 
 async def get_db() -> AsyncSession:
@@ -40,8 +64,70 @@ async def get_db() -> AsyncSession:
             await session.close()
 
 
+def _create_missing_indexes(sync_conn):
+    """create_all() only builds indexes with new tables - add any missing ones"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+def _merge_duplicate_entities(sync_conn):
+    """
+    Fold duplicate (user_id, name, entity_type) entities into one row
+    
+    Databases from before ix_entity_user_name_type was unique can hold
+    duplicates (left by concurrent extractions for the same user), which
+    would make creating the index fail. The lowest id is kept: relations
+    are repointed to it and the mention counts and dates combined.
+    """
+    existing = {index["name"] for index in inspect(sync_conn).get_indexes("entities")}
+    if "ix_entity_user_name_type" in existing:
+        return
+    
+    entities = Base.metadata.tables["entities"]
+    relations = Base.metadata.tables["relations"]
+    key = (entities.c.user_id, entities.c.name, entities.c.entity_type)
+    
+    groups = sync_conn.execute(
+        select(
+            *key,
+            func.min(entities.c.id),
+            func.sum(entities.c.mention_count),
+            func.min(entities.c.first_mentioned),
+            func.max(entities.c.last_mentioned)
+        )
+        .group_by(*key)
+        .having(func.count() > 1)
+    ).all()
+    
+    for user_id, name, entity_type, keep_id, mentions, first, last in groups:
+        duplicate_ids = sync_conn.scalars(
+            select(entities.c.id).where(
+                entities.c.user_id == user_id,
+                entities.c.name == name,
+                entities.c.entity_type == entity_type,
+                entities.c.id != keep_id
+            )
+        ).all()
+        for column in (relations.c.entity1_id, relations.c.entity2_id):
+            sync_conn.execute(
+                update(relations).where(column.in_(duplicate_ids)).values({column: keep_id})
+            )
+        sync_conn.execute(
+            update(entities)
+            .where(entities.c.id == keep_id)
+            .values(mention_count=mentions, first_mentioned=first, last_mentioned=last)
+        )
+        sync_conn.execute(delete(entities).where(entities.c.id.in_(duplicate_ids)))
+    
+    if groups:
+        log.warning("⚠️ Merged %d duplicated entities before adding ix_entity_user_name_type", len(groups))
+
+
 async def init_db():
-    """Initialize database tables"""
+    """Initialize database tables and indexes"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_merge_duplicate_entities)
+        await conn.run_sync(_create_missing_indexes)
 
@@ -0,0 +1,45 @@
+"""
+Shared outbound HTTP client (Layercode API, recording downloads)
+"""
+from functools import lru_cache
+import httpx
+from fastapi import Request
+
+# Seconds allowed to open a connection, whatever the request timeout
+CONNECT_TIMEOUT = 5.0
+
+
+def build_http_client(timeout: float = 10.0) -> httpx.AsyncClient:
+    """
+    Build a pooled AsyncClient
+    
+    One pooled client keeps TCP/TLS connections to the same hosts alive
+    between requests instead of handshaking on every call.
+    
+    Args:
+        timeout: Per-request timeout in seconds (connecting is capped at
+            CONNECT_TIMEOUT, so an unreachable host fails fast and can be
+            retried instead of eating the whole budget)
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(timeout, connect=min(timeout, CONNECT_TIMEOUT)),
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+    )
+
+
+@lru_cache()
+def get_shared_http_client() -> httpx.AsyncClient:
+    """
+    Get the process-wide client
+    
+    The same instance is exposed as app.state.http for request handlers
+    and used directly by code that runs outside a request (background
+    downloads). Closed from the app lifespan.
+    """
+    return build_http_client()
+
+
+async def get_http_client(request: Request) -> httpx.AsyncClient:
+    """Dependency to get the app's shared HTTP client"""
+    return request.app.state.http
@@ -0,0 +1,36 @@
+"""
+Logging setup for EchoDiary
+
+Handlers on the event loop thread only enqueue records; a QueueListener
+thread does the formatting-to-stream I/O, so a burst of errors can't block
+the loop on stderr writes.
+"""
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def start_logging(level: int = logging.INFO) -> QueueListener:
+    """
+    Route the root logger through a queue and start the writer thread
+    
+    Args:
+        level: Root log level
+        
+    Returns:
+        The running listener (stop it on shutdown to flush)
+    """
+    log_queue = queue.SimpleQueue()
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(log_queue)]
+    root.setLevel(level)
+    
+    listener.start()
+    return listener
@@ -2,40 +2,130 @@
 EchoDiary - Main FastAPI Application
 """
 import os
+import gzip
+import logging
+import hashlib
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from app.config import get_settings
 from app.database import init_db
+from app.http_client import get_shared_http_client
+from app.services.openai_service import get_openai_client
+from app.logging_config import start_logging
+from app.redis_client import get_redis_client
+from app.routes.cron import run_due_checkins
 
 settings = get_settings()
+log = logging.getLogger(__name__)
+
+PAGES_DIR = "templates"
+
+
+def load_pages(directory: str = PAGES_DIR) -> dict:
+    """
+    Read every frontend page once, with its gzip body and ETag
+    
+    Returns:
+        {filename: (body, gzipped_body, etag)}
+    """
+    pages = {}
+    for name in os.listdir(directory):
+        if name.endswith(".html"):
+            with open(os.path.join(directory, name), "rb") as f:
+                body = f.read()
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            pages[name] = (body, gzip.compress(body), etag)
+    return pages
+
+
+@asynccontextmanager
+async def redis_lifespan(app: FastAPI):
+    """Shared Redis client (one per process)"""
+    app.state.redis = get_redis_client()
+    log.info("✅ Redis client ready")
+    try:
+        yield
+    finally:
+        await app.state.redis.close()
+        log.info("✅ Redis client closed")
+
+
+@asynccontextmanager
+async def http_lifespan(app: FastAPI):
+    """Shared outbound HTTP clients (one connection pool per process)"""
+    app.state.http = get_shared_http_client()
+    log.info("✅ HTTP client ready")
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+        await get_openai_client().close()
+        log.info("✅ HTTP clients closed")
+
+
+@asynccontextmanager
+async def scheduler_lifespan(app: FastAPI):
+    """Background scheduler for due check-ins"""
+    scheduler = AsyncIOScheduler()
+    if settings.scheduler_enabled:
+        scheduler.add_job(
+            run_due_checkins,
+            "interval",
+            minutes=settings.checkin_poll_minutes,
+            id="checkins",
+            max_instances=1,
+            coalesce=True
+        )
+        scheduler.start()
+        log.info("✅ Check-in scheduler running every %d min", settings.checkin_poll_minutes)
+    app.state.scheduler = scheduler
+    try:
+        yield
+    finally:
+        if scheduler.running:
+            scheduler.shutdown(wait=False)
+            log.info("✅ Scheduler stopped")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Application lifespan - startup and shutdown"""
+    """
+    Application lifespan - startup and shutdown
+    
+    Resources are nested so they start in order (Redis before the
+    scheduler that uses it) and shut down in reverse.
+    """
     # Startup
-    print("🚀 Starting EchoDiary...")
+    log_listener = start_logging(logging.DEBUG if settings.debug else logging.INFO)
+    log.info("🚀 Starting EchoDiary...")
     
     # Initialize database
     await init_db()
-    print("✅ Database initialized")
+    log.info("✅ Database initialized")
     
     # Create audio storage directory
     os.makedirs(settings.audio_storage_path, exist_ok=True)
-    print(f"✅ Audio storage ready: {settings.audio_storage_path}")
-    
-    # TODO: Initialize Redis connection pool
-    # TODO: Start background scheduler for check-ins
+    log.info("✅ Audio storage ready: %s", settings.audio_storage_path)
     
-    yield
+    # Frontend pages are served from memory
+    app.state.pages = load_pages()
+    log.info("✅ Loaded %d frontend pages", len(app.state.pages))
     
-    # Shutdown
-    print("👋 Shutting down EchoDiary...")
-    # TODO: Close Redis connection
-    # TODO: Stop scheduler
+    try:
+        async with redis_lifespan(app):
+            async with http_lifespan(app):
+                async with scheduler_lifespan(app):
+                    yield
+                    
+                    # Shutdown
+                    log.info("👋 Shutting down EchoDiary...")
+    finally:
+        # Flush queued log records
+        log_listener.stop()
 
 
 # Create FastAPI app
@@ -43,16 +133,18 @@ app = FastAPI(
     title=settings.app_name,
     version=settings.app_version,
     description="Voice-first AI diary and emotional companion",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Configure appropriately for production
+    allow_origins=settings.cors_origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,  # let browsers cache preflights for a day
 )
 
 
@@ -66,7 +158,7 @@ async def health_check():
         "database": "connected",
         "services": {
             "openai": bool(settings.openai_api_key),
-            "redis": bool(settings.upstash_redis_url)
+            "redis": bool(settings.redis_url or settings.upstash_redis_url)
         }
     }
 
@@ -85,35 +177,27 @@ app.include_router(cron.router, prefix="/cron", tags=["Scheduled Tasks"])
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
-# Serve frontend pages
-@app.get("/")
-async def serve_index():
-    """Serve main page"""
-    return FileResponse("templates/index.html")
-
-
-@app.get("/call.html")
-async def serve_call():
-    """Serve call details page"""
-    return FileResponse("templates/call.html")
-
-
-@app.get("/graph.html")
-async def serve_graph():
-    """Serve knowledge graph page"""
-    return FileResponse("templates/graph.html")
-
-
-@app.get("/stats.html")
-async def serve_stats():
-    """Serve statistics page"""
-    return FileResponse("templates/stats.html")
-
-
-@app.get("/talk.html")
-async def serve_talk():
-    """Serve web calling page"""
-    return FileResponse("templates/talk.html")
+# Serve frontend pages (/, /call.html, /graph.html, ...)
+# Registered last so it only sees paths no router matched. Bodies, gzip
+# copies and ETags are built once at startup, so a page load is a dict
+# lookup (or a bodyless 304) with no filesystem access.
+@app.get("/", include_in_schema=False)
+@app.get("/{page}", include_in_schema=False)
+async def serve_page(request: Request, page: str = "index.html"):
+    """Serve a preloaded frontend page"""
+    entry = request.app.state.pages.get(page)
+    if entry is None:
+        return Response(status_code=404)
+    
+    body, gzipped, etag = entry
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        body = gzipped
+    return Response(content=body, media_type="text/html", headers=headers)
 
 
 if __name__ == "__main__":
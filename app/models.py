@@ -2,114 +2,141 @@
 SQLAlchemy database models for EchoDiary
 """
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey, Boolean, JSON
-from sqlalchemy.orm import relationship
+from typing import Any, List, Optional
+from sqlalchemy import text, Integer, String, Float, DateTime, Text, ForeignKey, Boolean, JSON, Index
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.database import Base
 
 
+# Binary JSONB on Postgres (indexable, no re-parse per row), plain JSON elsewhere
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
+
 class User(Base):
     """User profile and preferences"""
     __tablename__ = "users"
     
-    id = Column(Integer, primary_key=True, index=True)
-    phone_number = Column(String(20), unique=True, index=True, nullable=False)
-    name = Column(String(100), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    phone_number: Mapped[str] = mapped_column(String(20), unique=True, index=True)
+    name: Mapped[Optional[str]] = mapped_column(String(100))
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # User preferences
-    preferred_mode = Column(String(20), default="reassure")  # reassure, tough_love, listener
-    baseline_mood = Column(Float, default=5.0)
+    preferred_mode: Mapped[Optional[str]] = mapped_column(String(20), default="reassure")  # reassure, tough_love, listener
+    baseline_mood: Mapped[Optional[float]] = mapped_column(Float, default=5.0)
     
-    # Relationships
-    calls = relationship("Call", back_populates="user", cascade="all, delete-orphan")
-    entities = relationship("Entity", back_populates="user", cascade="all, delete-orphan")
+    # Relationships (unbounded collections stay lazy - load them per query
+    # with selectinload() instead of on every User fetch)
+    calls: Mapped[List["Call"]] = relationship(back_populates="user", cascade="all, delete-orphan")
+    entities: Mapped[List["Entity"]] = relationship(back_populates="user", cascade="all, delete-orphan")
 
 
 class Call(Base):
     """Individual call records"""
     __tablename__ = "calls"
+    __table_args__ = (
+        # A user's calls newest-first (/calls?user_id=...) as an index range scan
+        Index("ix_calls_user_start", "user_id", "start_time"),
+        # GIN index so Call.tags.contains([...]) is an index lookup on Postgres
+        Index("ix_calls_tags_gin", "tags", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     
     # Twilio details
-    call_sid = Column(String(100), unique=True, index=True, nullable=False)
-    from_number = Column(String(20), nullable=False)
+    call_sid: Mapped[str] = mapped_column(String(100), unique=True, index=True)
+    from_number: Mapped[str] = mapped_column(String(20))
     
     # Call metadata
-    start_time = Column(DateTime, default=datetime.utcnow)
-    end_time = Column(DateTime, nullable=True)
-    duration_seconds = Column(Integer, nullable=True)
+    start_time: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    end_time: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    duration_seconds: Mapped[Optional[int]] = mapped_column(Integer)
     
     # Conversation details
-    mode = Column(String(20), default="reassure")  # conversation mode chosen
-    mood_score = Column(Float, nullable=True)  # 1-10 scale
-    sentiment = Column(String(20), nullable=True)  # positive, neutral, negative
+    mode: Mapped[Optional[str]] = mapped_column(String(20), default="reassure")  # conversation mode chosen
+    mood_score: Mapped[Optional[float]] = mapped_column(Float)  # 1-10 scale
+    sentiment: Mapped[Optional[str]] = mapped_column(String(20))  # positive, neutral, negative
     
     # Audio storage
-    audio_url = Column(String(500), nullable=True)
-    audio_duration = Column(Integer, nullable=True)
+    audio_url: Mapped[Optional[str]] = mapped_column(String(500))
+    audio_duration: Mapped[Optional[int]] = mapped_column(Integer)
     
     # Summary
-    summary = Column(Text, nullable=True)
-    tags = Column(JSON, nullable=True)  # ["stressed", "work", "family"]
-    
-    # Relationships
-    user = relationship("User", back_populates="calls")
-    transcripts = relationship("Transcript", back_populates="call", cascade="all, delete-orphan")
-    relations = relationship("Relation", back_populates="call", cascade="all, delete-orphan")
+    summary: Mapped[Optional[str]] = mapped_column(Text)
+    tags: Mapped[Optional[Any]] = mapped_column(JSONType)  # ["stressed", "work", "family"]
+    
+    # Relationships (lazy - the webhook and task paths fetch bare calls;
+    # readers opt in per query with selectinload() / safe_select())
+    user: Mapped["User"] = relationship(back_populates="calls")
+    # Loaded in conversation order (served by ix_transcripts_call_ts)
+    transcripts: Mapped[List["Transcript"]] = relationship(
+        back_populates="call",
+        cascade="all, delete-orphan",
+        order_by="[Transcript.timestamp, Transcript.id]"
+    )
+    relations: Mapped[List["Relation"]] = relationship(back_populates="call", cascade="all, delete-orphan")
 
 
 class Transcript(Base):
     """Conversation transcripts (turn by turn)"""
     __tablename__ = "transcripts"
+    __table_args__ = (
+        # Serves "turns for a call in order" straight from the index; also
+        # covers plain call_id lookups, so no separate call_id index
+        Index("ix_transcripts_call_ts", "call_id", "timestamp", postgresql_include=["speaker"]),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    call_id = Column(Integer, ForeignKey("calls.id"), nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    call_id: Mapped[int] = mapped_column(ForeignKey("calls.id"))
     
     # Turn details
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    speaker = Column(String(20), nullable=False)  # "user" or "agent"
-    text = Column(Text, nullable=False)
+    timestamp: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    speaker: Mapped[str] = mapped_column(String(20))  # "user" or "agent"
+    text: Mapped[str] = mapped_column(Text)
     
     # Optional metadata
-    confidence = Column(Float, nullable=True)  # STT confidence score
-    emotion = Column(String(50), nullable=True)  # detected emotion
+    confidence: Mapped[Optional[float]] = mapped_column(Float)  # STT confidence score
+    emotion: Mapped[Optional[str]] = mapped_column(String(50))  # detected emotion
     
     # Relationships
-    call = relationship("Call", back_populates="transcripts")
+    call: Mapped["Call"] = relationship(back_populates="transcripts")
 
 
 class Entity(Base):
     """Knowledge graph entities"""
     __tablename__ = "entities"
+    __table_args__ = (
+        # One row per (user, name, type) - the post-call upsert's conflict
+        # target; also serves the (user_id, name) lookups
+        Index("ix_entity_user_name_type", "user_id", "name", "entity_type", unique=True),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     
     # Entity details
-    name = Column(String(200), nullable=False)
-    entity_type = Column(String(50), nullable=False)  # Person, Place, Org, Topic, Emotion
+    name: Mapped[str] = mapped_column(String(200))
+    entity_type: Mapped[str] = mapped_column(String(50))  # Person, Place, Org, Topic, Emotion
     
     # Metadata
-    first_mentioned = Column(DateTime, default=datetime.utcnow)
-    last_mentioned = Column(DateTime, default=datetime.utcnow)
-    mention_count = Column(Integer, default=1)
+    first_mentioned: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    last_mentioned: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    mention_count: Mapped[Optional[int]] = mapped_column(Integer, default=1)
     
     # Additional properties (JSON for flexibility)
-    properties = Column(JSON, nullable=True)
+    properties: Mapped[Optional[Any]] = mapped_column(JSONType)
     
     # Relationships
-    user = relationship("User", back_populates="entities")
-    relations_from = relationship(
-        "Relation",
+    user: Mapped["User"] = relationship(back_populates="entities")
+    relations_from: Mapped[List["Relation"]] = relationship(
         foreign_keys="Relation.entity1_id",
         back_populates="entity1",
         cascade="all, delete-orphan"
     )
-    relations_to = relationship(
-        "Relation",
+    relations_to: Mapped[List["Relation"]] = relationship(
         foreign_keys="Relation.entity2_id",
         back_populates="entity2",
         cascade="all, delete-orphan"
@@ -120,46 +147,54 @@ class Relation(Base):
     """Knowledge graph relations between entities"""
     __tablename__ = "relations"
     
-    id = Column(Integer, primary_key=True, index=True)
-    call_id = Column(Integer, ForeignKey("calls.id"), nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    call_id: Mapped[int] = mapped_column(ForeignKey("calls.id"), index=True)
     
     # Relation details
-    entity1_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
-    entity2_id = Column(Integer, ForeignKey("entities.id"), nullable=False)
-    relation_type = Column(String(50), nullable=False)  # met_with, argued_with, worked_on, felt, went_to
+    entity1_id: Mapped[int] = mapped_column(ForeignKey("entities.id"), index=True)
+    entity2_id: Mapped[int] = mapped_column(ForeignKey("entities.id"), index=True)
+    relation_type: Mapped[str] = mapped_column(String(50))  # met_with, argued_with, worked_on, felt, went_to
     
     # Metadata
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    context = Column(Text, nullable=True)  # Optional context snippet
+    timestamp: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+    context: Mapped[Optional[str]] = mapped_column(Text)  # Optional context snippet
     
     # Relationships
-    call = relationship("Call", back_populates="relations")
-    entity1 = relationship("Entity", foreign_keys=[entity1_id], back_populates="relations_from")
-    entity2 = relationship("Entity", foreign_keys=[entity2_id], back_populates="relations_to")
+    call: Mapped["Call"] = relationship(back_populates="relations")
+    entity1: Mapped["Entity"] = relationship(foreign_keys=[entity1_id], back_populates="relations_from")
+    entity2: Mapped["Entity"] = relationship(foreign_keys=[entity2_id], back_populates="relations_to")
 
 
 class CheckIn(Base):
     """Scheduled check-ins for users"""
     __tablename__ = "checkins"
+    __table_args__ = (
+        # Partial index: only the pending rows the cron claim scans for
+        Index(
+            "ix_checkin_pending_due",
+            "scheduled_time",
+            postgresql_where=text("status = 'pending'"),
+            sqlite_where=text("status = 'pending'")
+        ),
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    call_id = Column(Integer, ForeignKey("calls.id"), nullable=True)  # Reference to triggering call
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    call_id: Mapped[Optional[int]] = mapped_column(ForeignKey("calls.id"))  # Reference to triggering call
     
     # Schedule details
-    scheduled_time = Column(DateTime, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    scheduled_time: Mapped[datetime] = mapped_column(DateTime, index=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
     
     # Status
-    status = Column(String(20), default="pending")  # pending, completed, failed, cancelled
-    completed_at = Column(DateTime, nullable=True)
+    status: Mapped[Optional[str]] = mapped_column(String(20), default="pending", index=True)  # pending, processing, completed, failed, cancelled
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime)  # last claim time until completed
     
     # Check-in details
-    reason = Column(Text, nullable=True)  # Why check-in was scheduled
-    message = Column(Text, nullable=True)  # Generated message
-    delivery_method = Column(String(20), default="sms")  # sms or call
+    reason: Mapped[Optional[str]] = mapped_column(Text)  # Why check-in was scheduled
+    message: Mapped[Optional[str]] = mapped_column(Text)  # Generated message
+    delivery_method: Mapped[Optional[str]] = mapped_column(String(20), default="sms")  # sms or call
     
     # Result
-    twilio_sid = Column(String(100), nullable=True)  # Twilio message/call SID
-    success = Column(Boolean, default=False)
-
+    twilio_sid: Mapped[Optional[str]] = mapped_column(String(100))  # Twilio message/call SID
+    success: Mapped[Optional[bool]] = mapped_column(Boolean, default=False)
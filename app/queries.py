@@ -0,0 +1,48 @@
+"""
+Query helpers shared by the read-path routes
+"""
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, raiseload
+
+
+def safe_select(model, *eager):
+    """
+    Build a SELECT for `model` that eagerly loads only the given relationships
+
+    Every other relationship (including those on the eagerly loaded
+    objects) is set to raise on access, so a handler that
+    touches something it didn't declare fails loudly instead of silently
+    falling back to one lazy query per row.
+
+    Args:
+        model: Mapped class to select
+        eager: Relationship attributes to load, e.g. Call.transcripts
+
+    Returns:
+        Select statement
+    """
+    return select(model).options(
+        *[selectinload(rel).raiseload("*") for rel in eager],
+        raiseload("*")
+    )
+
+
+def upsert_insert(db: AsyncSession, model):
+    """
+    Build an INSERT for `model` that supports ON CONFLICT for the session's database
+    
+    Postgres and SQLite (3.35+) both take on_conflict_do_update(...) and
+    .returning(...), through their own dialect insert constructs.
+    
+    Args:
+        db: Session the statement will run on
+        model: Mapped class to insert into
+        
+    Returns:
+        Dialect-specific Insert statement
+    """
+    if db.bind.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
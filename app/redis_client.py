@@ -1,163 +1,391 @@
 """
-Redis client for session and context management using Upstash
+Redis client for session and context management
+
+Talks native RESP over TCP (redis.asyncio) when REDIS_URL is set, and falls
+back to the Upstash REST API for deployments without socket access.
 """
+import logging
+from functools import lru_cache
 from typing import Optional, Dict, Any
-import json
-from upstash_redis import Redis
-from app.config import get_settings
+import orjson
+from cachetools import TTLCache
+import redis.asyncio as aioredis
+from fastapi import Request
+from upstash_redis.asyncio import Redis as UpstashRedis
+from app.config import Settings, get_settings
+
+log = logging.getLogger(__name__)
 
-settings = get_settings()
+
+# Append a turn (to the trimmed context buffer and the untrimmed transcript
+# list), refresh the TTLs and read the buffer back as one atomic step, so
+# concurrent webhook turns can't interleave
+APPEND_TURN_LUA = """
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+redis.call('RPUSH', KEYS[2], ARGV[4])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+return redis.call('LRANGE', KEYS[1], 0, -1)
+"""
+
+# Same for the agent's reply, without the read back and with a TTL refresh
+# on the session hash
+ADD_REPLY_LUA = """
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[2]), -1)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+redis.call('RPUSH', KEYS[2], ARGV[4])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[3], tonumber(ARGV[3]))
+return 1
+"""
+
+# HSET fields only if the session still exists (never recreates an expired
+# session without its TTL); one round-trip instead of EXISTS then HSET
+PATCH_SESSION_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+def call_key(prefix: str, call_id: str) -> str:
+    """
+    Redis key for one of a call's session/turns/transcript entries
+    
+    The call id is a hash tag ({...}), so all of a call's keys land in one
+    cluster slot and the multi-key scripts and DEL work on Redis Cluster
+    and multi-shard Upstash (no CROSSSLOT).
+    """
+    return f"{prefix}:{{{call_id}}}"
+
+
+# Phone -> user lookups change only when preferences do
+USER_BY_PHONE_TTL = 86400
 
 
 class RedisClient:
-    """Wrapper for Upstash Redis operations"""
+    """Wrapper for Redis operations (native protocol or Upstash REST)"""
+    
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.native = bool(settings.redis_url)
+        # Read-through caches for the hot per-webhook reads. Redis stays the
+        # source of truth; the short TTL bounds staleness across workers.
+        self._session_cache: TTLCache = TTLCache(maxsize=1024, ttl=settings.local_cache_ttl_seconds)
+        self._profile_cache: TTLCache = TTLCache(maxsize=1024, ttl=settings.local_cache_ttl_seconds)
+        if self.native:
+            self.client = aioredis.Redis.from_url(
+                settings.redis_url,
+                decode_responses=True,
+                max_connections=settings.redis_max_connections
+            )
+        else:
+            self.client = UpstashRedis(
+                url=settings.upstash_redis_url,
+                token=settings.upstash_redis_token
+            )
     
-    def __init__(self):
-        self.client = Redis(
-            url=settings.upstash_redis_url,
-            token=settings.upstash_redis_token
-        )
+    async def close(self):
+        """Close the connection pool / HTTP session"""
+        if self.native:
+            await self.client.aclose()
+        else:
+            await self.client.close()
+    
+    # The two clients only differ in how pipelines and HSET are spelled
+    
+    def _pipeline(self):
+        """Start a non-transactional pipeline"""
+        if self.native:
+            return self.client.pipeline(transaction=False)
+        return self.client.pipeline()
+    
+    async def _execute(self, pipe) -> list:
+        """Send a pipeline in one round-trip"""
+        if self.native:
+            return await pipe.execute()
+        return await pipe.exec()
+    
+    def _hset(self, target, key: str, mapping: Dict[str, str]):
+        """HSET several fields on the client or a pipeline"""
+        if self.native:
+            return target.hset(key, mapping=mapping)
+        return target.hset(key, values=mapping)
+    
+    async def _eval(self, script: str, keys: list, args: list):
+        """Run a Lua script server-side"""
+        if self.native:
+            return await self.client.eval(script, len(keys), *keys, *args)
+        return await self.client.eval(script, keys=keys, args=args)
+    
+    @staticmethod
+    def _encode_fields(data: Dict[str, Any]) -> Dict[str, str]:
+        """Encode each session field so types survive the Redis hash"""
+        return {field: orjson.dumps(value).decode() for field, value in data.items()}
     
     async def set_session(self, call_id: str, data: Dict[str, Any], ttl: int = None) -> bool:
-        """Store session data for a call"""
-        key = f"session:{call_id}"
-        ttl = ttl or settings.session_ttl_seconds
+        """
+        Store session data for a call
+        
+        Session metadata is a Redis hash (one field per key) so later
+        updates only touch the fields that changed.
+        """
+        key = call_key("session", call_id)
+        ttl = ttl or self.settings.session_ttl_seconds
+        self._session_cache.pop(call_id, None)
         try:
-            self.client.set(key, json.dumps(data), ex=ttl)
+            pipe = self._pipeline()
+            pipe.delete(key)
+            self._hset(pipe, key, self._encode_fields(data))
+            pipe.expire(key, ttl)
+            await self._execute(pipe)
             return True
         except Exception as e:
-            print(f"Error setting session: {e}")
+            log.error("❌ Error setting session: %s", e)
             return False
     
     async def get_session(self, call_id: str) -> Optional[Dict[str, Any]]:
-        """Retrieve session data for a call"""
-        key = f"session:{call_id}"
+        """Retrieve session data for a call (served from memory when cached)"""
+        cached = self._session_cache.get(call_id)
+        if cached is not None:
+            return dict(cached)
+        key = call_key("session", call_id)
         try:
-            data = self.client.get(key)
+            data = await self.client.hgetall(key)
             if data:
-                return json.loads(data)
+                session = {field: orjson.loads(value) for field, value in data.items()}
+                self._session_cache[call_id] = session
+                return dict(session)
             return None
         except Exception as e:
-            print(f"Error getting session: {e}")
+            log.error("❌ Error getting session: %s", e)
             return None
     
     async def update_session(self, call_id: str, data: Dict[str, Any]) -> bool:
-        """Update existing session data"""
-        existing = await self.get_session(call_id)
-        if existing:
-            existing.update(data)
-            return await self.set_session(call_id, existing)
-        return False
+        """Update existing session data (only the given fields are written)"""
+        self._session_cache.pop(call_id, None)
+        args = []
+        for field, value in self._encode_fields(data).items():
+            args += [field, value]
+        try:
+            updated = await self._eval(PATCH_SESSION_LUA, keys=[call_key("session", call_id)], args=args)
+            return bool(updated)
+        except Exception as e:
+            log.error("❌ Error updating session: %s", e)
+            return False
     
     async def delete_session(self, call_id: str) -> bool:
-        """Delete session data"""
-        key = f"session:{call_id}"
+        """Delete session data, its turn buffer and transcript"""
+        self._session_cache.pop(call_id, None)
         try:
-            self.client.delete(key)
+            await self.client.delete(call_key("session", call_id), call_key("turns", call_id), call_key("transcript", call_id))
             return True
         except Exception as e:
-            print(f"Error deleting session: {e}")
+            log.error("❌ Error deleting session: %s", e)
             return False
     
     async def set_value(self, key: str, value: str, expiry: int = None) -> bool:
         """Store a generic key-value pair with optional expiry (in seconds)"""
         try:
             if expiry:
-                self.client.set(key, value, ex=expiry)
+                await self.client.set(key, value, ex=expiry)
             else:
-                self.client.set(key, value)
+                await self.client.set(key, value)
             return True
         except Exception as e:
-            print(f"Error setting value for key {key}: {e}")
+            log.error("❌ Error setting value for key %s: %s", key, e)
             return False
     
     async def get_value(self, key: str) -> Optional[str]:
         """Retrieve a generic value by key"""
         try:
-            return self.client.get(key)
+            return await self.client.get(key)
         except Exception as e:
-            print(f"Error getting value for key {key}: {e}")
+            log.error("❌ Error getting value for key %s: %s", key, e)
             return None
     
     async def set_user_profile(self, user_id: int, data: Dict[str, Any]) -> bool:
         """Store user profile data"""
         key = f"user:{user_id}"
+        self._profile_cache.pop(user_id, None)
         try:
-            self.client.set(key, json.dumps(data))
+            await self.client.set(key, orjson.dumps(data).decode())
             return True
         except Exception as e:
-            print(f"Error setting user profile: {e}")
+            log.error("❌ Error setting user profile: %s", e)
             return False
     
     async def get_user_profile(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Retrieve user profile data"""
+        """Retrieve user profile data (served from memory when cached)"""
+        cached = self._profile_cache.get(user_id)
+        if cached is not None:
+            return dict(cached)
         key = f"user:{user_id}"
         try:
-            data = self.client.get(key)
+            data = await self.client.get(key)
+            if data:
+                profile = orjson.loads(data)
+                self._profile_cache[user_id] = profile
+                return dict(profile)
+            return None
+        except Exception as e:
+            log.error("❌ Error getting user profile: %s", e)
+            return None
+    
+    async def set_user_by_phone(self, phone_number: str, user: Dict[str, Any]) -> bool:
+        """
+        Cache the user id and preferred mode for a phone number
+        
+        Nothing in the app changes a user's preferences, so entries simply
+        expire after USER_BY_PHONE_TTL; a preference edited directly in the
+        database shows up on calls within that window.
+        """
+        key = f"user_by_phone:{phone_number}"
+        try:
+            await self.client.set(key, orjson.dumps(user).decode(), ex=USER_BY_PHONE_TTL)
+            return True
+        except Exception as e:
+            log.error("❌ Error caching user for phone: %s", e)
+            return False
+    
+    async def get_user_by_phone(self, phone_number: str) -> Optional[Dict[str, Any]]:
+        """Get the cached {id, preferred_mode} for a phone number"""
+        key = f"user_by_phone:{phone_number}"
+        try:
+            data = await self.client.get(key)
             if data:
-                return json.loads(data)
+                return orjson.loads(data)
             return None
         except Exception as e:
-            print(f"Error getting user profile: {e}")
+            log.error("❌ Error getting user for phone: %s", e)
             return None
     
     async def set_checkin_flag(self, user_id: int, checkin_data: Dict[str, Any], ttl: int = None) -> bool:
         """Set a check-in flag for a user"""
         key = f"checkin:{user_id}"
-        ttl = ttl or (settings.checkin_delay_hours * 3600)
+        ttl = ttl or self.settings.checkin_delay_seconds
         try:
-            self.client.set(key, json.dumps(checkin_data), ex=ttl)
+            await self.client.set(key, orjson.dumps(checkin_data).decode(), ex=ttl)
             return True
         except Exception as e:
-            print(f"Error setting check-in flag: {e}")
+            log.error("❌ Error setting check-in flag: %s", e)
             return False
     
     async def get_checkin_flag(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Get check-in flag for a user"""
         key = f"checkin:{user_id}"
         try:
-            data = self.client.get(key)
+            data = await self.client.get(key)
             if data:
-                return json.loads(data)
+                return orjson.loads(data)
             return None
         except Exception as e:
-            print(f"Error getting check-in flag: {e}")
+            log.error("❌ Error getting check-in flag: %s", e)
             return None
     
     async def delete_checkin_flag(self, user_id: int) -> bool:
         """Delete check-in flag"""
         key = f"checkin:{user_id}"
         try:
-            self.client.delete(key)
+            await self.client.delete(key)
             return True
         except Exception as e:
-            print(f"Error deleting check-in flag: {e}")
+            log.error("❌ Error deleting check-in flag: %s", e)
             return False
     
-    async def add_turn_to_context(self, call_id: str, speaker: str, text: str) -> bool:
-        """Add a conversation turn to the context buffer"""
-        session = await self.get_session(call_id)
-        if not session:
-            return False
+    async def add_turn_and_get_context(self, call_id: str, speaker: str, text: str) -> list:
+        """
+        Add a conversation turn to the context buffer and return the buffer
         
-        turns = session.get("turns", [])
-        turns.append({"speaker": speaker, "text": text})
+        Turns live in their own list (turns:{call_id}) and are appended by
+        a Lua script, so RPUSH + LTRIM + EXPIRE + LRANGE run atomically in a
+        single round-trip instead of a write followed by a separate read.
+        The same script appends the line to the call's full transcript
+        (transcript:{call_id}). Unlike the turn buffer the transcript is
+        never trimmed, so end-of-call processing can read the whole
+        conversation back in one LRANGE instead of re-selecting every
+        Transcript row.
         
-        # Keep only last N turns
-        if len(turns) > settings.context_turns_limit * 2:  # user + agent = 2x
-            turns = turns[-(settings.context_turns_limit * 2):]
+        Returns:
+            Recent turns including the new one ([] on error)
+        """
+        try:
+            turns = await self._eval(
+                APPEND_TURN_LUA,
+                keys=[call_key("turns", call_id), call_key("transcript", call_id)],
+                args=[
+                    orjson.dumps({"speaker": speaker, "text": text}).decode(),
+                    # Keep only last N turns (user + agent = 2x)
+                    self.settings.context_turns_limit * 2,
+                    self.settings.session_ttl_seconds,
+                    f"{speaker}: {text}"
+                ]
+            )
+            return [orjson.loads(turn) for turn in turns]
+        except Exception as e:
+            log.error("❌ Error adding turn to context: %s", e)
+            return []
+    
+    async def add_reply(self, call_id: str, agent_text: str) -> bool:
+        """
+        Record the agent's reply in one round-trip
         
-        session["turns"] = turns
-        return await self.set_session(call_id, session)
+        Appends the agent turn to the context buffer and the call's full
+        transcript (the user's line is already there, from
+        add_turn_and_get_context). The session's TTL is refreshed in the
+        same script, so an active call never outlives its session.
+        """
+        try:
+            await self._eval(
+                ADD_REPLY_LUA,
+                keys=[call_key("turns", call_id), call_key("transcript", call_id), call_key("session", call_id)],
+                args=[
+                    orjson.dumps({"speaker": "agent", "text": agent_text}).decode(),
+                    self.settings.context_turns_limit * 2,
+                    self.settings.session_ttl_seconds,
+                    f"agent: {agent_text}"
+                ]
+            )
+            return True
+        except Exception as e:
+            log.error("❌ Error adding reply: %s", e)
+            return False
     
     async def get_context(self, call_id: str) -> list:
         """Get conversation context (recent turns)"""
-        session = await self.get_session(call_id)
-        if session:
-            return session.get("turns", [])
-        return []
+        try:
+            turns = await self.client.lrange(call_key("turns", call_id), 0, -1)
+            return [orjson.loads(turn) for turn in turns]
+        except Exception as e:
+            log.error("❌ Error getting context: %s", e)
+            return []
+    
+    async def get_transcript(self, call_id: str) -> Optional[str]:
+        """Get the full transcript as newline-joined lines (None on a miss)"""
+        try:
+            lines = await self.client.lrange(call_key("transcript", call_id), 0, -1)
+            return "\n".join(lines) if lines else None
+        except Exception as e:
+            log.error("❌ Error getting transcript: %s", e)
+            return None
+
+
+@lru_cache()
+def get_redis_client() -> RedisClient:
+    """
+    Get the shared Redis client
+    
+    Built on first use (normally from the app lifespan) rather than at
+    import time, so importing this module doesn't read .env or open a
+    connection.
+    """
+    return RedisClient(get_settings())
 
 
-# Global Redis client instance
-redis_client = RedisClient()
+async def get_redis(request: Request) -> RedisClient:
+    """Dependency to get the app's Redis client"""
+    return request.app.state.redis
 
@@ -0,0 +1,153 @@
+"""
+Custom response classes
+"""
+import hashlib
+import os
+import re
+from typing import Optional, Tuple
+import anyio
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+# Single "bytes=start-end" / "bytes=start-" / "bytes=-suffix" range
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+# Returned by _requested_range when the range lies outside the file
+UNSATISFIABLE = (-1, -1)
+
+
+def etag_json_response(request: Request, body: bytes) -> Response:
+    """
+    Send pre-encoded JSON with a content-hash ETag
+
+    Answers 304 with no body when the client already holds this version
+    (If-None-Match), so polling pages skip the download and JSON parse.
+    """
+    etag = f'"{hashlib.blake2s(body, digest_size=8).hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+class RangeFileResponse(FileResponse):
+    """
+    FileResponse with single-range (HTTP 206) support
+
+    Browsers seek in <audio> elements with Range requests; this serves just
+    the requested window instead of the whole recording. Multi-range and
+    malformed headers, or an If-Range that no longer matches the ETag, fall
+    back to the full file as RFC 9110 allows.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.stat_result is None:
+            self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            self.set_stat_headers(self.stat_result)
+        self.headers["accept-ranges"] = "bytes"
+
+        byte_range = self._requested_range(scope)
+        if byte_range is None:
+            await self._send_full(scope, receive, send)
+        elif byte_range == UNSATISFIABLE:
+            await send({
+                "type": "http.response.start",
+                "status": 416,
+                "headers": [(b"content-range", f"bytes */{self.stat_result.st_size}".encode())],
+            })
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            await self._send_range(scope, send, *byte_range)
+
+    async def _send_full(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Send the whole file (200)"""
+        await super().__call__(scope, receive, send)
+
+    def _requested_range(self, scope: Scope) -> Optional[Tuple[int, int]]:
+        """
+        Parse the Range header against the file size
+
+        Returns:
+            (start, end) inclusive, UNSATISFIABLE, or None to send everything
+        """
+        headers = Headers(scope=scope)
+        value = headers.get("range")
+        if not value:
+            return None
+
+        if_range = headers.get("if-range")
+        if if_range and if_range != self.headers.get("etag"):
+            return None
+
+        match = RANGE_RE.match(value.strip())
+        if not match:
+            return None
+
+        size = self.stat_result.st_size
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        elif last:
+            start = max(size - int(last), 0)
+            end = size - 1
+        else:
+            return None
+
+        if start > end or start >= size:
+            return UNSATISFIABLE
+        return start, end
+
+    async def _send_range(self, scope: Scope, send: Send, start: int, end: int) -> None:
+        """Send bytes start..end inclusive (206)"""
+        length = end - start + 1
+        headers = [(k, v) for k, v in self.raw_headers if k != b"content-length"]
+        headers.append((b"content-range", f"bytes {start}-{end}/{self.stat_result.st_size}".encode()))
+        headers.append((b"content-length", str(length).encode()))
+        await send({"type": "http.response.start", "status": 206, "headers": headers})
+
+        if scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+        else:
+            async with await anyio.open_file(self.path, "rb") as f:
+                await f.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = await f.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+
+        if self.background is not None:
+            await self.background()
+
+
+class PathSendFileResponse(RangeFileResponse):
+    """
+    RangeFileResponse that lets the server send full files itself
+
+    When the ASGI server advertises the http.response.pathsend extension
+    (e.g. Granian), a full-file body is handed over as a path so it can go
+    out via sendfile(2) instead of being read in chunks on the event loop.
+    """
+
+    async def _send_full(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions") or {}
+        if "http.response.pathsend" not in extensions or scope.get("method") == "HEAD":
+            await super()._send_full(scope, receive, send)
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        await send({
+            "type": "http.response.pathsend",
+            "path": os.path.abspath(self.path),
+        })
+        if self.background is not None:
+            await self.background()
@@ -1,20 +1,27 @@
 """
 Web UI API endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, update, func, true
+from sqlalchemy.orm import selectinload, raiseload, load_only
 from typing import List, Optional
-import os
+from functools import lru_cache
+from pydantic import TypeAdapter
+import logging
+import orjson
 
-from app.database import get_db
+from app.cache import graph_cache
+from app.database import AsyncSessionLocal, get_db
+from app.http_client import get_http_client
 from app.models import User, Call, Transcript, Entity, Relation
+from app.queries import safe_select
+from app.responses import RangeFileResponse, PathSendFileResponse, etag_json_response
+from app.redis_client import RedisClient, get_redis, get_redis_client
 from app.schemas import (
     CallResponse,
     CallDetailResponse,
-    TranscriptResponse,
     EntityResponse,
     RelationResponse,
     GraphResponse,
@@ -22,17 +29,74 @@ from app.schemas import (
 )
 from app.services.audio_service import AudioService
 from app.services.export_service import ExportService
+from app.services.openai_service import OpenAIService
 from app.config import get_settings
 import httpx
 
+log = logging.getLogger(__name__)
+
 router = APIRouter()
 audio_service = AudioService()
 export_service = ExportService()
+openai_service = OpenAIService()
 settings = get_settings()
 
+# Audio files above this size are handed to the server to sendfile()
+SENDFILE_MIN_BYTES = 1024 * 1024
+
+AUDIO_MEDIA_TYPES = {
+    '.wav': 'audio/wav',
+    '.mp3': 'audio/mpeg',
+    '.m4a': 'audio/mp4',
+    '.ogg': 'audio/ogg',
+    '.flac': 'audio/flac'
+}
+INLINE_DISPOSITION = 'inline; filename="{}"'
+ATTACHMENT_DISPOSITION = 'attachment; filename="{}"'
+
+# Columns each response schema actually serializes, so list/detail
+# queries don't pull audio paths, confidences, etc. they never return
+CALL_LIST_COLUMNS = (
+    Call.id, Call.call_sid, Call.from_number, Call.start_time, Call.end_time,
+    Call.duration_seconds, Call.mode, Call.mood_score, Call.sentiment,
+    Call.summary, Call.tags
+)
+CALL_DETAIL_COLUMNS = CALL_LIST_COLUMNS + (Call.audio_url,)
+TRANSCRIPT_COLUMNS = (
+    Transcript.id, Transcript.timestamp, Transcript.speaker,
+    Transcript.text, Transcript.emotion
+)
+
+# Reflection job status is kept this long for the page to poll
+REFLECTION_STATUS_TTL = 3600
+
+# Built once; validates ORM rows and encodes straight to JSON bytes
+CALL_LIST_ADAPTER = TypeAdapter(List[CallResponse])
+
+# Call columns the transcript exports read
+EXPORT_CALL_COLUMNS = (
+    Call.start_time, Call.duration_seconds, Call.mood_score,
+    Call.mode, Call.summary, Call.tags
+)
+# Transcript rows fetched per batch while an export streams
+TRANSCRIPT_YIELD_PER = 100
+
+# Reflection request template (filled with the joined transcript)
+REFLECTION_PROMPT = """
+Create a 20-second (about 50 words) empathetic reflection recap of this diary conversation.
+Summarize key feelings, topics, and provide a warm closing thought.
+
+Conversation:
+{conversation}
+
+Make it feel like a gentle, caring voice companion speaking directly to the user.
+Keep it under 50 words for a 20-second audio clip.
+"""
+
 
 @router.get("/calls", response_model=List[CallResponse])
 async def get_calls(
+    request: Request,
     user_id: Optional[int] = None,
     limit: int = Query(50, le=100),
     offset: int = 0,
@@ -40,22 +104,32 @@ async def get_calls(
 ):
     """
     Get list of calls with metadata
+    
+    Carries an ETag so polling clients get a bodyless 304 while the list
+    is unchanged.
     """
     try:
-        query = select(Call).order_by(Call.start_time.desc())
+        query = (
+            safe_select(Call)
+            .options(load_only(*CALL_LIST_COLUMNS))
+            .order_by(Call.start_time.desc())
+        )
         
         if user_id:
             query = query.where(Call.user_id == user_id)
         
         query = query.limit(limit).offset(offset)
         
-        result = await db.execute(query)
-        calls = result.scalars().all()
+        # Rows are consumed off a server-side cursor as they arrive
+        calls = [call async for call in await db.stream_scalars(query)]
         
-        return [CallResponse.model_validate(call) for call in calls]
+        body = CALL_LIST_ADAPTER.dump_json(
+            CALL_LIST_ADAPTER.validate_python(calls, from_attributes=True)
+        )
+        return etag_json_response(request, body)
         
-    except Exception as e:
-        print(f"Error getting calls: {e}")
+    except Exception:
+        log.exception("Error getting calls")
         raise HTTPException(status_code=500, detail="Error retrieving calls")
 
 
@@ -69,28 +143,34 @@ async def get_call_details(
     """
     try:
         result = await db.execute(
-            select(Call)
+            safe_select(Call)
+            .options(
+                load_only(*CALL_DETAIL_COLUMNS),
+                selectinload(Call.transcripts).options(
+                    load_only(*TRANSCRIPT_COLUMNS),
+                    raiseload("*")
+                )
+            )
             .where(Call.id == call_id)
-            .options(selectinload(Call.transcripts))
         )
         call = result.scalar_one_or_none()
         
         if not call:
             raise HTTPException(status_code=404, detail="Call not found")
         
-        # Convert to response model
-        call_data = CallResponse.model_validate(call)
-        transcripts = [TranscriptResponse.model_validate(t) for t in call.transcripts]
-        
-        return CallDetailResponse(
-            **call_data.model_dump(),
-            transcripts=transcripts
+        # Convert to response model in one validation pass (transcripts
+        # are read straight off the ORM relationship) and encode it in
+        # pydantic-core, skipping FastAPI's jsonable_encoder walk over
+        # every transcript
+        return Response(
+            content=CallDetailResponse.model_validate(call).model_dump_json(),
+            media_type="application/json"
         )
         
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error getting call details: {e}")
+    except Exception:
+        log.exception("Error getting call details")
         raise HTTPException(status_code=500, detail="Error retrieving call details")
 
 
@@ -110,38 +190,35 @@ async def get_call_audio(
     """
     try:
         result = await db.execute(
-            select(Call).where(Call.id == call_id)
+            safe_select(Call).where(Call.id == call_id)
         )
         call = result.scalar_one_or_none()
         
         if not call:
             raise HTTPException(status_code=404, detail="Call not found")
         
-        # Check for local audio file first
-        local_path = audio_service.get_audio_file_path(call_id)
-        
-        if local_path and os.path.exists(local_path):
-            # Determine media type from file extension
-            ext = os.path.splitext(local_path)[1].lower()
-            media_types = {
-                '.wav': 'audio/wav',
-                '.mp3': 'audio/mpeg',
-                '.m4a': 'audio/mp4',
-                '.ogg': 'audio/ogg',
-                '.flac': 'audio/flac'
-            }
-            media_type = media_types.get(ext, 'audio/wav')
+        # Check for local audio file first (one stat, reused for the
+        # response headers)
+        found = audio_service.find_audio_file(call_id)
+        
+        if found:
+            local_path, ext, stat_result = found
+            media_type = AUDIO_MEDIA_TYPES.get(ext, 'audio/wav')
             
             # Get filename for download
             filename = f"echodiary_call_{call_id}{ext}"
             
-            # Serve local file
-            return FileResponse(
+            # Serve local file (Range requests get 206 so the player can
+            # seek) - full reads of large recordings go out via pathsend
+            # (sendfile) when the server supports it
+            response_class = PathSendFileResponse if stat_result.st_size > SENDFILE_MIN_BYTES else RangeFileResponse
+            return response_class(
                 local_path,
                 media_type=media_type,
                 filename=filename,
+                stat_result=stat_result,
                 headers={
-                    "Content-Disposition": f'{"attachment" if download else "inline"}; filename="{filename}"'
+                    "Content-Disposition": (ATTACHMENT_DISPOSITION if download else INLINE_DISPOSITION).format(filename)
                 }
             )
         
@@ -154,12 +231,49 @@ async def get_call_audio(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error getting audio: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error getting audio")
         raise HTTPException(status_code=500, detail=f"Error retrieving audio: {str(e)}")
 
 
+async def _load_export(db: AsyncSession, call_id: int):
+    """
+    Fetch the call fields an export header needs and open a stream over
+    its transcripts
+    
+    Raises 404 before any response is started if either is missing.
+    
+    Returns:
+        (call, async iterator of Transcript rows in order)
+    """
+    result = await db.execute(
+        safe_select(Call)
+        .options(load_only(*EXPORT_CALL_COLUMNS))
+        .where(Call.id == call_id)
+    )
+    call = result.scalar_one_or_none()
+    
+    if not call:
+        raise HTTPException(status_code=404, detail="Call not found")
+    
+    rows = await db.stream_scalars(
+        safe_select(Transcript)
+        .where(Transcript.call_id == call_id)
+        .order_by(Transcript.timestamp, Transcript.id)
+        .execution_options(yield_per=TRANSCRIPT_YIELD_PER)
+    )
+    first = await anext(rows, None)
+    if first is None:
+        await rows.close()
+        raise HTTPException(status_code=404, detail="No transcript available")
+    
+    async def transcripts():
+        yield first
+        async for t in rows:
+            yield t
+    
+    return call, transcripts()
+
+
 @router.get("/calls/{call_id}/export/text")
 async def export_transcript_text(
     call_id: int,
@@ -169,26 +283,13 @@ async def export_transcript_text(
     Export conversation transcript as clean formatted text
     """
     try:
-        # Get call with transcripts
-        result = await db.execute(
-            select(Call)
-            .where(Call.id == call_id)
-            .options(selectinload(Call.transcripts))
-        )
-        call = result.scalar_one_or_none()
-        
-        if not call:
-            raise HTTPException(status_code=404, detail="Call not found")
-        
-        if not call.transcripts:
-            raise HTTPException(status_code=404, detail="No transcript available")
-        
-        # Format transcript
-        formatted_text = export_service.format_transcript_text(call, call.transcripts)
+        call, transcripts = await _load_export(db, call_id)
         filename = export_service.get_filename(call, "txt")
         
-        return PlainTextResponse(
-            content=formatted_text,
+        # Stream the document as turns are read
+        return StreamingResponse(
+            export_service.stream_transcript_text(call, transcripts),
+            media_type="text/plain; charset=utf-8",
             headers={
                 "Content-Disposition": f'attachment; filename="{filename}"'
             }
@@ -196,8 +297,8 @@ async def export_transcript_text(
         
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error exporting transcript: {e}")
+    except Exception:
+        log.exception("Error exporting transcript")
         raise HTTPException(status_code=500, detail="Error exporting transcript")
 
 
@@ -210,27 +311,12 @@ async def export_transcript_markdown(
     Export conversation transcript as Markdown
     """
     try:
-        # Get call with transcripts
-        result = await db.execute(
-            select(Call)
-            .where(Call.id == call_id)
-            .options(selectinload(Call.transcripts))
-        )
-        call = result.scalar_one_or_none()
-        
-        if not call:
-            raise HTTPException(status_code=404, detail="Call not found")
-        
-        if not call.transcripts:
-            raise HTTPException(status_code=404, detail="No transcript available")
-        
-        # Format transcript
-        formatted_md = export_service.format_transcript_markdown(call, call.transcripts)
+        call, transcripts = await _load_export(db, call_id)
         filename = export_service.get_filename(call, "md")
         
-        return PlainTextResponse(
-            content=formatted_md,
-            media_type="text/markdown",
+        return StreamingResponse(
+            export_service.stream_transcript_markdown(call, transcripts),
+            media_type="text/markdown; charset=utf-8",
             headers={
                 "Content-Disposition": f'attachment; filename="{filename}"'
             }
@@ -238,13 +324,14 @@ async def export_transcript_markdown(
         
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error exporting transcript: {e}")
+    except Exception:
+        log.exception("Error exporting transcript")
         raise HTTPException(status_code=500, detail="Error exporting transcript")
 
 
 @router.get("/graph", response_model=GraphResponse)
 async def get_knowledge_graph(
+    request: Request,
     user_id: Optional[int] = None,
     limit_nodes: int = Query(100, le=500),
     db: AsyncSession = Depends(get_db)
@@ -252,47 +339,59 @@ async def get_knowledge_graph(
     """
     Get knowledge graph nodes and edges for visualization
     """
+    # Cached as encoded JSON, so a hit (or a 304) costs no DB or encoding work
+    cache_key = (user_id, limit_nodes)
+    cached = graph_cache.get(cache_key)
+    if cached is not None:
+        return etag_json_response(request, cached)
+    
     try:
-        # Get entities (nodes)
-        entity_query = select(Entity).limit(limit_nodes)
+        # Nodes plus their outgoing edges in two statements: the entities,
+        # then one selectin batch for relations_from. Only the columns the
+        # graph payload needs are loaded, and edge endpoints are attached
+        # from the node set in Python rather than joined back in SQL.
+        entity_query = select(Entity).options(
+            load_only(Entity.id, Entity.name, Entity.entity_type, Entity.mention_count, Entity.properties),
+            selectinload(Entity.relations_from).options(
+                load_only(Relation.id, Relation.entity1_id, Relation.entity2_id, Relation.relation_type, Relation.context),
+                raiseload("*")
+            ),
+            raiseload("*")
+        ).limit(limit_nodes)
         if user_id:
             entity_query = entity_query.where(Entity.user_id == user_id)
         
         entity_result = await db.execute(entity_query)
         entities = entity_result.scalars().all()
         
-        # Get relations (edges) for these entities
-        entity_ids = [e.id for e in entities]
-        if entity_ids:
-            relation_query = select(Relation).where(
-                Relation.entity1_id.in_(entity_ids),
-                Relation.entity2_id.in_(entity_ids)
-            ).options(
-                selectinload(Relation.entity1),
-                selectinload(Relation.entity2)
-            )
-            
-            relation_result = await db.execute(relation_query)
-            relations = relation_result.scalars().all()
-        else:
-            relations = []
-        
         # Convert to response models
-        nodes = [EntityResponse.model_validate(e) for e in entities]
+        nodes_by_id = {e.id: EntityResponse.model_validate(e) for e in entities}
+        nodes = list(nodes_by_id.values())
         edges = []
         
-        for r in relations:
-            try:
-                edge_data = RelationResponse.model_validate(r)
-                edges.append(edge_data)
-            except Exception as e:
-                print(f"⚠️ Skipping invalid relation: {e}")
-                continue
-        
-        return GraphResponse(nodes=nodes, edges=edges)
-        
-    except Exception as e:
-        print(f"Error getting graph: {e}")
+        for e in entities:
+            for r in e.relations_from:
+                # Keep only edges whose far end is also on the graph
+                if r.entity2_id not in nodes_by_id:
+                    continue
+                try:
+                    edges.append(RelationResponse(
+                        id=r.id,
+                        entity1=nodes_by_id[r.entity1_id],
+                        entity2=nodes_by_id[r.entity2_id],
+                        relation_type=r.relation_type,
+                        context=r.context
+                    ))
+                except Exception as ex:
+                    log.warning("⚠️ Skipping invalid relation: %s", ex)
+                    continue
+        
+        body = GraphResponse(nodes=nodes, edges=edges).model_dump_json().encode()
+        graph_cache[cache_key] = body
+        return etag_json_response(request, body)
+        
+    except Exception:
+        log.exception("Error getting graph")
         raise HTTPException(status_code=500, detail="Error retrieving knowledge graph")
 
 
@@ -305,20 +404,22 @@ async def get_user_profile(
     Get user profile and stats
     """
     try:
-        # Get user
+        # User row and call count in one round-trip
+        call_count_sq = (
+            select(func.count(Call.id))
+            .where(Call.user_id == User.id)
+            .scalar_subquery()
+        )
         result = await db.execute(
-            select(User).where(User.id == user_id)
+            safe_select(User)
+            .add_columns(call_count_sq.label("total_calls"))
+            .where(User.id == user_id)
         )
-        user = result.scalar_one_or_none()
+        row = result.first()
         
-        if not user:
+        if not row:
             raise HTTPException(status_code=404, detail="User not found")
-        
-        # Get call count
-        count_result = await db.execute(
-            select(func.count(Call.id)).where(Call.user_id == user_id)
-        )
-        call_count = count_result.scalar()
+        user, call_count = row
         
         user_data = UserResponse.model_validate(user)
         user_data.total_calls = call_count
@@ -327,81 +428,122 @@ async def get_user_profile(
         
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Error getting user profile: {e}")
+    except Exception:
+        log.exception("Error getting user profile")
         raise HTTPException(status_code=500, detail="Error retrieving user profile")
 
 
-@router.post("/reflection/{call_id}")
+def _reflection_key(call_id: int) -> str:
+    return f"reflection:{call_id}"
+
+
+async def run_reflection(call_id: int, full_text: str):
+    """
+    Generate a reflection and store it on the call (background task)
+    
+    Progress is kept in Redis under reflection:{call_id} so the page can
+    poll GET /reflection/{call_id}.
+    """
+    redis = get_redis_client()
+    key = _reflection_key(call_id)
+    try:
+        reflection_text = await openai_service.generate_response(
+            transcript=REFLECTION_PROMPT.format(conversation=full_text),
+            context=[],
+            mode="reassure",
+            # An outage must end as "failed", not store a filler line
+            raise_on_error=True
+        )
+        
+        # Store reflection in call record
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Call).where(Call.id == call_id).values(summary=reflection_text)
+            )
+            await db.commit()
+        
+        await redis.set_value(key, orjson.dumps({
+            "status": "completed",
+            "reflection": reflection_text
+        }).decode(), expiry=REFLECTION_STATUS_TTL)
+        
+    except Exception:
+        log.exception("Error generating reflection for call %s", call_id)
+        await redis.set_value(key, orjson.dumps({"status": "failed"}).decode(), expiry=REFLECTION_STATUS_TTL)
+
+
+@router.post("/reflection/{call_id}", status_code=202)
 async def generate_reflection(
     call_id: int,
-    db: AsyncSession = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db),
+    redis: RedisClient = Depends(get_redis)
 ):
     """
-    Generate 20-second reflection recap for a call
-    Returns text recap (audio generation via Rime/Layercode handled separately)
+    Start generating a 20-second reflection recap for a call
+    
+    The LLM call runs after the response is sent; poll
+    GET /reflection/{call_id} for the text recap (audio generation via
+    Rime/Layercode handled separately)
     """
     try:
-        # Get call with transcripts
+        key = _reflection_key(call_id)
+        job = await redis.get_value(key)
+        if job and orjson.loads(job).get("status") == "pending":
+            # Already running - don't start a second generation
+            return {"status": "pending", "call_id": call_id}
+        
+        # Get call with transcripts (only the two columns the prompt uses)
         result = await db.execute(
-            select(Call)
+            safe_select(Call)
+            .options(
+                selectinload(Call.transcripts).options(
+                    load_only(Transcript.speaker, Transcript.text),
+                    raiseload("*")
+                )
+            )
             .where(Call.id == call_id)
-            .options(selectinload(Call.transcripts))
         )
         call = result.scalar_one_or_none()
         
         if not call:
             raise HTTPException(status_code=404, detail="Call not found")
         
-        # Combine transcript text
-        full_text = "\n".join([
-            f"{t.speaker}: {t.text}"
-            for t in call.transcripts
-        ])
-        
-        if not full_text:
+        if not call.transcripts:
             raise HTTPException(status_code=400, detail="No transcript available")
         
-        # Generate reflection using OpenAI
-        from app.services.openai_service import OpenAIService
-        openai_service = OpenAIService()
-        
-        reflection_prompt = f"""
-Create a 20-second (about 50 words) empathetic reflection recap of this diary conversation.
-Summarize key feelings, topics, and provide a warm closing thought.
-
-Conversation:
-{full_text}
-
-Make it feel like a gentle, caring voice companion speaking directly to the user.
-Keep it under 50 words for a 20-second audio clip.
-"""
+        # Combine transcript text
+        full_text = "\n".join(f"{t.speaker}: {t.text}" for t in call.transcripts)
         
-        reflection_text = await openai_service.generate_response(
-            transcript=reflection_prompt,
-            context=[],
-            mode="reassure"
-        )
+        await redis.set_value(key, orjson.dumps({"status": "pending"}).decode(), expiry=REFLECTION_STATUS_TTL)
+        background_tasks.add_task(run_reflection, call_id, full_text)
         
-        # Store reflection in call record
-        call.summary = reflection_text
-        await db.commit()
-        
-        return {
-            "reflection": reflection_text,
-            "status": "completed",
-            "call_id": call_id
-        }
+        return {"status": "pending", "call_id": call_id}
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error generating reflection: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error generating reflection")
         raise HTTPException(status_code=500, detail=f"Error generating reflection: {str(e)}")
 
 
+@router.get("/reflection/{call_id}")
+async def get_reflection(
+    call_id: int,
+    redis: RedisClient = Depends(get_redis)
+):
+    """
+    Poll a reflection started by POST /reflection/{call_id}
+    
+    Returns status pending/completed/failed, plus the text once completed
+    """
+    job = await redis.get_value(_reflection_key(call_id))
+    if not job:
+        raise HTTPException(status_code=404, detail="No reflection in progress")
+    
+    return {"call_id": call_id, **orjson.loads(job)}
+
+
 @router.get("/stats/{user_id}")
 async def get_user_stats(
     user_id: int,
@@ -411,30 +553,38 @@ async def get_user_stats(
     Get user statistics and mood trends
     """
     try:
-        # Get average mood score
-        mood_result = await db.execute(
-            select(func.avg(Call.mood_score))
-            .where(Call.user_id == user_id, Call.mood_score.isnot(None))
-        )
-        avg_mood = mood_result.scalar() or 5.0
-        
-        # Get total calls
-        count_result = await db.execute(
-            select(func.count(Call.id)).where(Call.user_id == user_id)
+        # Totals and the 10 most recent scored calls in one round-trip:
+        # the totals row is LEFT JOINed to the recent rows, so it comes
+        # back (with NULL trend columns) even when nothing is scored yet
+        totals = (
+            select(
+                func.count(Call.id).label("total_calls"),
+                func.avg(Call.mood_score).label("avg_mood")  # AVG skips NULL scores
+            )
+            .where(Call.user_id == user_id)
+            .subquery()
         )
-        total_calls = count_result.scalar()
-        
-        # Get recent calls for trend
-        recent_result = await db.execute(
+        recent = (
             select(Call.mood_score, Call.start_time)
             .where(Call.user_id == user_id, Call.mood_score.isnot(None))
             .order_by(Call.start_time.desc())
             .limit(10)
+            .subquery()
+        )
+        result = await db.stream(
+            select(totals.c.total_calls, totals.c.avg_mood, recent.c.mood_score, recent.c.start_time)
+            .select_from(totals.outerjoin(recent, true()))
+            .order_by(recent.c.start_time.desc())
         )
-        recent_moods = [
-            {"mood": row[0], "date": row[1].isoformat()}
-            for row in recent_result.all()
-        ]
+        
+        # Every row repeats the totals; build the trend as rows stream in
+        total_calls, avg_mood = 0, None
+        recent_moods = []
+        async for row in result:
+            total_calls, avg_mood = row.total_calls, row.avg_mood
+            if row.start_time is not None:
+                recent_moods.append({"mood": row.mood_score, "date": row.start_time.isoformat()})
+        avg_mood = avg_mood or 5.0
         
         return {
             "total_calls": total_calls,
@@ -442,25 +592,35 @@ async def get_user_stats(
             "mood_trend": recent_moods
         }
         
-    except Exception as e:
-        print(f"Error getting stats: {e}")
+    except Exception:
+        log.exception("Error getting stats")
         raise HTTPException(status_code=500, detail="Error retrieving statistics")
 
 
 @router.get("/config")
-async def get_frontend_config():
+async def get_frontend_config(request: Request):
     """
     Get configuration for frontend (non-sensitive data only)
     """
-    return {
+    return etag_json_response(request, frontend_config())
+
+
+@lru_cache(maxsize=1)
+def frontend_config() -> bytes:
+    """Settings are frozen, so the frontend config is encoded once"""
+    return orjson.dumps({
         "layercode_agent_id": settings.layercode_agent_id,
         "app_name": settings.app_name,
         "app_version": settings.app_version
-    }
+    })
 
 
 @router.post("/authorize")
-async def authorize_layercode_session(request: dict):
+async def authorize_layercode_session(
+    request: dict,
+    redis: RedisClient = Depends(get_redis),
+    http: httpx.AsyncClient = Depends(get_http_client)
+):
     """
     Authorization endpoint for Layercode Web SDK
     
@@ -489,44 +649,39 @@ async def authorize_layercode_session(request: dict):
         # Call Layercode authorization API
         layercode_auth_url = "https://api.layercode.com/v1/agents/web/authorize_session"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                layercode_auth_url,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {settings.layercode_api_key}"
-                },
-                json=request
+        response = await http.post(
+            layercode_auth_url,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {settings.layercode_api_key}"
+            },
+            json=request
+        )
+        
+        if not response.is_success:
+            error_text = response.text
+            log.error("❌ Layercode authorization failed: %s", error_text)
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Layercode authorization failed: {error_text}"
             )
-            
-            if not response.is_success:
-                error_text = response.text
-                print(f"❌ Layercode authorization failed: {error_text}")
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Layercode authorization failed: {error_text}"
-                )
-            
-            auth_data = response.json()
-            conversation_id = auth_data.get('conversation_id')
-            print(f"✅ Layercode session authorized: {conversation_id or 'new session'}")
-            
-            # Store metadata in Redis for later retrieval in webhook
-            if conversation_id and request.get("metadata"):
-                from app.redis_client import redis_client
-                import json
-                metadata_key = f"conversation_metadata:{conversation_id}"
-                await redis_client.set_value(metadata_key, json.dumps(request["metadata"]), expiry=3600)  # 1 hour
-                print(f"💾 Stored metadata for conversation {conversation_id}: {request['metadata']}")
-            
-            return auth_data
-            
+        
+        auth_data = orjson.loads(response.content)
+        conversation_id = auth_data.get('conversation_id')
+        log.info("✅ Layercode session authorized: %s", conversation_id or "new session")
+        
+        # Store metadata in Redis for later retrieval in webhook
+        if conversation_id and request.get("metadata"):
+            metadata_key = f"conversation_metadata:{conversation_id}"
+            await redis.set_value(metadata_key, orjson.dumps(request["metadata"]).decode(), expiry=3600)  # 1 hour
+            log.info("💾 Stored metadata for conversation %s: %s", conversation_id, request["metadata"])
+        
+        return auth_data
+        
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in Layercode authorization: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Error in Layercode authorization")
         raise HTTPException(
             status_code=500,
             detail=f"Authorization error: {str(e)}"
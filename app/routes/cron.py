@@ -3,21 +3,59 @@ Cron and scheduled task endpoints
 """
 from fastapi import APIRouter, Depends, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
-from datetime import datetime
-from typing import List
+from sqlalchemy import select, update, and_, or_
+from datetime import datetime, timedelta
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+from cachetools import TTLCache
 
-from app.database import get_db
+from app.database import AsyncSessionLocal, get_db
 from app.models import CheckIn, User, Call
-from app.redis_client import redis_client
+from app.queries import safe_select
+from app.redis_client import get_redis_client
 from app.services.openai_service import OpenAIService
 from app.config import get_settings
 
 router = APIRouter()
+log = logging.getLogger(__name__)
 settings = get_settings()
 
 openai_service = OpenAIService()
 
+# Most check-ins claimed per run
+CHECKIN_BATCH_SIZE = 100
+
+# Check-ins processed at the same time within a batch
+CHECKIN_CONCURRENCY = 10
+
+# A "processing" claim older than this is treated as abandoned (the worker
+# died before finishing) and can be claimed again
+CHECKIN_LEASE = timedelta(minutes=30)
+
+# Wait at least this long before retrying a check-in that failed
+CHECKIN_RETRY_DELAY = timedelta(minutes=30)
+
+# Stop retrying a check-in this long after it was due
+CHECKIN_GIVE_UP_AFTER = timedelta(hours=6)
+
+CHECKIN_PROMPT = """
+Generate a brief, caring check-in message for a user named {name}.
+
+Context: {reason}
+
+The message should:
+- Be warm and genuine
+- Reference the context briefly
+- Show you care
+- Be under 100 words for SMS
+
+Return only the message text, no quotes or formatting.
+"""
+
+# (name, reason, baseline mood) -> generated message
+checkin_message_cache: TTLCache = TTLCache(maxsize=512, ttl=3600)
+
 # Note: Check-in delivery (SMS/calls) now handled via Layercode API
 # See LAYERCODE_SETUP.md for outbound call configuration
 
@@ -32,61 +70,146 @@ async def process_checkins(
     This endpoint should be called by a cron job every 15-30 minutes
     """
     try:
-        # Get pending check-ins that are due
-        result = await db.execute(
-            select(CheckIn).where(
-                and_(
-                    CheckIn.status == "pending",
-                    CheckIn.scheduled_time <= datetime.utcnow()
-                )
-            )
-        )
-        checkins = result.scalars().all()
+        claimed = await claim_due_checkins(db)
         
-        processed_count = 0
-        for checkin in checkins:
-            # Add background task to process each check-in
-            background_tasks.add_task(process_checkin, checkin.id)
-            processed_count += 1
+        if claimed:
+            # One background task works through the batch with bounded concurrency
+            background_tasks.add_task(process_claimed_checkins, claimed)
         
         return {
             "status": "success",
-            "checkins_queued": processed_count
+            "checkins_queued": len(claimed)
         }
         
     except Exception as e:
-        print(f"Error processing check-ins: {e}")
+        log.exception("Error processing check-ins")
         return {
             "status": "error",
             "message": str(e)
         }
 
 
-async def process_checkin(checkin_id: int):
+async def claim_due_checkins(db: AsyncSession) -> List[Tuple[CheckIn, Optional[User]]]:
     """
-    Background task to process a single check-in
+    Atomically claim due check-ins and load their users
+    
+    One UPDATE ... RETURNING flips due rows to "processing" and stamps the
+    claim time in completed_at (SKIP LOCKED on Postgres), so overlapping
+    cron ticks or workers never pick up the same check-in; a second query
+    fetches all their users at once.
+    
+    A claim is a lease: rows left in "processing" longer than CHECKIN_LEASE
+    (worker restarted mid-batch) are claimed again. Failed attempts wait
+    CHECKIN_RETRY_DELAY, and attempted check-ins still undelivered
+    CHECKIN_GIVE_UP_AFTER past their due time are marked failed instead.
+    
+    Returns:
+        [(checkin, user)] - user is None if it no longer exists
     """
-    from app.database import AsyncSessionLocal
+    now = datetime.utcnow()
+    lease_expired = or_(CheckIn.completed_at.is_(None), CheckIn.completed_at <= now - CHECKIN_LEASE)
     
-    async with AsyncSessionLocal() as db:
-        try:
-            # Get check-in
-            result = await db.execute(
-                select(CheckIn).where(CheckIn.id == checkin_id)
+    # Retry window is over - stop picking these up (only rows that have had
+    # at least one attempt; an overdue check-in still gets its first try)
+    await db.execute(
+        update(CheckIn)
+        .where(
+            CheckIn.scheduled_time <= now - CHECKIN_GIVE_UP_AFTER,
+            CheckIn.completed_at.is_not(None),
+            or_(
+                CheckIn.status == "pending",
+                and_(CheckIn.status == "processing", lease_expired)
             )
-            checkin = result.scalar_one_or_none()
-            
-            if not checkin or checkin.status != "pending":
-                return
-            
-            # Get user
-            user_result = await db.execute(
-                select(User).where(User.id == checkin.user_id)
+        )
+        .values(status="failed", success=False),
+        execution_options={"synchronize_session": False}
+    )
+    
+    due_ids = (
+        select(CheckIn.id)
+        .where(
+            CheckIn.scheduled_time <= now,
+            or_(
+                # Due, and not attempted within the retry delay
+                and_(
+                    CheckIn.status == "pending",
+                    or_(CheckIn.completed_at.is_(None), CheckIn.completed_at <= now - CHECKIN_RETRY_DELAY)
+                ),
+                # Claimed by a worker that never finished
+                and_(CheckIn.status == "processing", lease_expired)
             )
-            user = user_result.scalar_one_or_none()
+        )
+        .limit(CHECKIN_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.scalars(
+        update(CheckIn)
+        .where(CheckIn.id.in_(due_ids))
+        .values(status="processing", completed_at=now)
+        .returning(CheckIn),
+        execution_options={"synchronize_session": False}
+    )
+    checkins = list(result.all())
+    await db.commit()
+    
+    if not checkins:
+        return []
+    
+    user_result = await db.scalars(
+        safe_select(User).where(User.id.in_({c.user_id for c in checkins}))
+    )
+    users = {u.id: u for u in user_result.all()}
+    
+    # Hand detached, fully loaded rows to the workers
+    db.expunge_all()
+    return [(c, users.get(c.user_id)) for c in checkins]
+
+
+async def run_due_checkins():
+    """
+    Scheduler job - process all due check-ins in-process
+    Runs every `checkin_poll_minutes` from the app lifespan
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            claimed = await claim_due_checkins(db)
+        
+        await process_claimed_checkins(claimed)
+        
+        if claimed:
+            log.info("⏰ Processed %d due check-ins", len(claimed))
             
+    except Exception:
+        log.exception("Error in scheduled check-ins")
+
+
+async def process_claimed_checkins(claimed: List[Tuple[CheckIn, Optional[User]]]):
+    """
+    Process a claimed batch, at most CHECKIN_CONCURRENCY at a time
+    
+    Each check-in is mostly waiting on OpenAI, so running several at once
+    clears a large batch far faster than one by one, while the semaphore
+    keeps DB sessions and API calls bounded.
+    """
+    semaphore = asyncio.Semaphore(CHECKIN_CONCURRENCY)
+    
+    async def bounded(checkin: CheckIn, user: Optional[User]):
+        async with semaphore:
+            await process_checkin(checkin, user)
+    
+    await asyncio.gather(*(bounded(checkin, user) for checkin, user in claimed))
+
+
+async def process_checkin(checkin: CheckIn, user: Optional[User]):
+    """
+    Background task to process a single claimed check-in
+    """
+    async with AsyncSessionLocal() as db:
+        try:
             if not user:
-                checkin.status = "failed"
+                await db.execute(
+                    update(CheckIn).where(CheckIn.id == checkin.id).values(status="failed")
+                )
                 await db.commit()
                 return
             
@@ -96,9 +219,9 @@ async def process_checkin(checkin_id: int):
             # TODO: Integrate with Layercode for outbound SMS/calls
             # For now, we'll just log the check-in and mark as completed
             
-            print(f"📞 Check-in scheduled for {user.phone_number}")
-            print(f"💬 Message: {message}")
-            print(f"📋 Method: {checkin.delivery_method}")
+            log.info("📞 Check-in scheduled for %s", user.phone_number)
+            log.info("💬 Message: %s", message)
+            log.info("📋 Method: %s", checkin.delivery_method)
             
             # In production, call Layercode API here to trigger outbound call/SMS
             # Example:
@@ -108,54 +231,61 @@ async def process_checkin(checkin_id: int):
             #     await layercode_api.trigger_outbound_call(user.phone_number, message)
             
             # Mark as completed (in production, only after successful delivery)
-            checkin.status = "completed"
-            checkin.message = message
-            checkin.completed_at = datetime.utcnow()
-            checkin.success = True
-            
+            await db.execute(
+                update(CheckIn)
+                .where(CheckIn.id == checkin.id)
+                .values(
+                    status="completed",
+                    message=message,
+                    completed_at=datetime.utcnow(),
+                    success=True
+                )
+            )
             await db.commit()
             
-        except Exception as e:
-            print(f"Error processing check-in {checkin_id}: {e}")
+        except Exception:
+            log.exception("Error processing check-in %s", checkin.id)
+            # Release the claim; completed_at keeps the attempt time, so the
+            # retry waits CHECKIN_RETRY_DELAY
+            await db.rollback()
+            await db.execute(
+                update(CheckIn).where(CheckIn.id == checkin.id).values(status="pending")
+            )
+            await db.commit()
 
 
 async def generate_checkin_message(checkin: CheckIn, user: User) -> str:
     """
     Generate personalized check-in message using OpenAI
+    
+    Messages are cached by (name, reason, baseline mood) - the only inputs
+    to the prompt - so identical check-ins in a batch cost one OpenAI call.
+    OpenAI errors propagate, so process_checkin releases the claim for a
+    retry instead of delivering (and caching) a filler line.
     """
-    try:
-        # Get user profile from Redis
-        user_profile = await redis_client.get_user_profile(user.id)
-        
-        prompt = f"""
-Generate a brief, caring check-in message for a user named {user.name or 'friend'}.
-
-Context: {checkin.reason}
-
-The message should:
-- Be warm and genuine
-- Reference the context briefly
-- Show you care
-- Be under 100 words for SMS
-
-Return only the message text, no quotes or formatting.
-"""
-        
-        context = []
-        if user_profile:
-            context = [{"speaker": "system", "text": f"User baseline mood: {user_profile.get('baseline_mood', 5)}"}]
-        
-        message = await openai_service.generate_response(
-            transcript=prompt,
-            context=context,
-            mode="reassure"
-        )
-        
-        return message
-        
-    except Exception as e:
-        print(f"Error generating check-in message: {e}")
-        return f"Hi! Just checking in on you. Hope you're doing okay. Reply anytime if you want to talk. - EchoDiary"
+    # Get user profile from Redis
+    user_profile = await get_redis_client().get_user_profile(user.id)
+    baseline_mood = user_profile.get("baseline_mood", 5) if user_profile else None
+    
+    name = user.name or "friend"
+    cache_key = (name, checkin.reason, baseline_mood)
+    cached = checkin_message_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    context = []
+    if user_profile:
+        context = [{"speaker": "system", "text": f"User baseline mood: {baseline_mood}"}]
+    
+    message = await openai_service.generate_response(
+        transcript=CHECKIN_PROMPT.format(name=name, reason=checkin.reason),
+        context=context,
+        mode="reassure",
+        raise_on_error=True
+    )
+    
+    checkin_message_cache[cache_key] = message
+    return message
 
 
 @router.post("/cleanup")
@@ -169,7 +299,7 @@ async def cleanup_old_sessions():
         return {"status": "success", "message": "Cleanup completed"}
         
     except Exception as e:
-        print(f"Error in cleanup: {e}")
+        log.exception("Error in cleanup")
         return {"status": "error", "message": str(e)}
 
 
@@ -2,30 +2,129 @@
 Layercode Webhook Handlers
 Receives events from Layercode pipeline
 """
-from fastapi import APIRouter, Request, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, Request, HTTPException
 from fastapi.responses import StreamingResponse
 from datetime import datetime
-from typing import Dict, Any, AsyncGenerator
-import json
+from typing import Dict, Any, AsyncGenerator, Optional
+import asyncio
+import logging
+import random
+import orjson
+from pydantic import TypeAdapter
 
-from app.database import AsyncSessionLocal
+from app.database import AsyncSessionLocal, get_db
 from app.models import User, Call, Transcript
-from app.redis_client import redis_client
+from app.queries import upsert_insert
+from app.redis_client import get_redis_client
 from app.services.openai_service import OpenAIService
 from app.services.layercode_service import LayercodeService
 from app.services.audio_service import AudioService
-from app.tasks import extract_and_store_entities, calculate_and_store_mood, generate_call_title
-from sqlalchemy import select
+from app.tasks import process_call_transcript
+from sqlalchemy import select, insert, update, func, literal, bindparam, lambda_stmt
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
+log = logging.getLogger(__name__)
 
 openai_service = OpenAIService()
 layercode_service = LayercodeService()
 audio_service = AudioService()
 
+# Built once at import so each webhook parses its body straight from bytes
+# with the compiled validator instead of request.json() + json.loads
+WEBHOOK_ADAPTER = TypeAdapter(Dict[str, Any])
+
+# Reply writes still running after their response (kept referenced so
+# they aren't garbage-collected mid-write)
+reply_writes: set = set()
+
+WELCOME_MESSAGES = (
+    "Hey, I'm Echo. I'm here for you. What's on your mind?",
+    "Hi! I'm Echo. Just so you know, this is your space. What's going on?",
+    "Hey there! I'm Echo, and I'm all ears. What's happening with you?",
+    "Hi! I'm Echo. Whatever you need to talk about, I'm here. What's up?"
+)
+
+# Per-webhook lookups as lambda statements: each is built and cache-keyed
+# once, so repeat calls skip straight to the compiled SQL
+TRANSCRIPT_LINES = lambda_stmt(
+    lambda: select(Transcript.speaker, Transcript.text)
+    .where(Transcript.call_id == bindparam("call_id"))
+    .order_by(Transcript.timestamp, Transcript.id)
+)
+TRANSCRIPT_TEXT_AGG = lambda_stmt(
+    lambda: select(func.string_agg(
+        Transcript.speaker + ": " + Transcript.text,
+        aggregate_order_by(literal("\n"), Transcript.timestamp, Transcript.id)
+    ))
+    .where(Transcript.call_id == bindparam("call_id"))
+)
+
+# Rows fetched per batch when streaming a transcript from the database
+TRANSCRIPT_YIELD_PER = 100
+
+# SSE frames are built as bytes so StreamingResponse sends them as-is
+EMPTY_FRAME = b"data: {}\n\n"
+END_FRAME_PREFIX = b'data: {"type":"response.end","turn_id":'
+# Only content, turn_id and emotion vary per response.tts frame; the rest
+# is pre-encoded ("speaker" is Rime's default, configurable in Layercode)
+TTS_FRAME_PREFIX = b'data: {"type":"response.tts","speaker":"default","content":'
+# The error fallback is fully constant apart from turn_id (calm, reassuring tone)
+ERROR_FRAME_PREFIX = (
+    TTS_FRAME_PREFIX + orjson.dumps("I'm here with you. Please continue.")
+    + b',"emotion":"calm","turn_id":'
+)
+# Stock welcome frames are likewise encoded once; only turn_id is spliced in
+WELCOME_FRAME_PREFIXES = tuple(
+    TTS_FRAME_PREFIX + orjson.dumps(text) + b',"emotion":"warm","turn_id":'
+    for text in WELCOME_MESSAGES
+)
+
+
+# Stop proxies (nginx) and intermediaries from buffering or transforming
+# the stream, so each frame reaches Layercode as soon as it's yielded
+SSE_HEADERS = {
+    "Cache-Control": "no-cache, no-transform",
+    "X-Accel-Buffering": "no"
+}
+
+
+def sse_response(frames: AsyncGenerator[bytes, None]) -> StreamingResponse:
+    """Stream SSE frames without buffering (no Content-Length is set)"""
+    return StreamingResponse(frames, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def tts_frame(content: str, turn_id: Any, emotion: str) -> bytes:
+    """Encode one response.tts frame"""
+    return (
+        TTS_FRAME_PREFIX + orjson.dumps(content)
+        + b',"turn_id":' + orjson.dumps(turn_id)
+        + b',"emotion":' + orjson.dumps(emotion) + b"}\n\n"
+    )
+
+
+def end_frame(turn_id: Any) -> bytes:
+    """Encode the response.end frame for a turn"""
+    return END_FRAME_PREFIX + orjson.dumps(turn_id) + b"}\n\n"
+
+
+def error_frame(turn_id: Any) -> bytes:
+    """Encode the fallback response.tts frame sent when a webhook fails"""
+    return ERROR_FRAME_PREFIX + orjson.dumps(turn_id) + b"}\n\n"
+
+
+def welcome_frame(turn_id: Any) -> bytes:
+    """Encode a randomly chosen stock welcome response.tts frame"""
+    return random.choice(WELCOME_FRAME_PREFIXES) + orjson.dumps(turn_id) + b"}\n\n"
+
 
 @router.post("/webhook/transcript")
-async def handle_transcript_webhook(request: Request):
+async def handle_transcript_webhook(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db)
+):
     """
     Main webhook endpoint for Layercode
     
@@ -39,58 +138,43 @@ async def handle_transcript_webhook(request: Request):
     """
     data = None
     try:
-        data = await request.json()
+        data = WEBHOOK_ADAPTER.validate_json(await request.body())
         
         # Log the incoming request for debugging
-        print(f"📥 Layercode webhook received: {data}")
+        log.debug("📥 Layercode webhook received: %.200s", data)
         
         # Extract event type (Layercode format)
         event_type = data.get("event") or data.get("type", "message")
         
         # Handle different event types
-        if event_type == "session.start":
-            return await handle_session_start(data)
-        elif event_type == "session.end" or event_type == "session.complete":
-            return await handle_session_end(data)
-        elif event_type == "session.update":
-            # Handle recording URL and other updates separately
-            return await handle_session_update(data)
-        elif event_type in ["message", "transcript", "user.transcript"]:
-            # Only process actual message events
-            return await handle_message(data)
-        else:
-            print(f"⚠️ Unknown event type: {event_type}")
-            # Return empty SSE stream for unknown events
-            async def empty_stream():
-                yield "data: {}\n\n"
-            return StreamingResponse(empty_stream(), media_type="text/event-stream")
+        handler = EVENT_HANDLERS.get(event_type)
+        if handler:
+            return await handler(data, background_tasks, db)
         
-    except Exception as e:
-        print(f"❌ Error in webhook: {e}")
-        import traceback
-        traceback.print_exc()
+        log.warning("⚠️ Unknown event type: %s", event_type)
+        # Return empty SSE stream for unknown events
+        async def empty_stream():
+            yield EMPTY_FRAME
+        return sse_response(empty_stream())
+        
+    except Exception:
+        # exc_info is captured here; the traceback is formatted by the log
+        # listener thread, not on the event loop
+        log.exception("❌ Error in webhook")
         
         # Return SSE stream even on error
         async def error_stream():
             turn_id = data.get("turn_id", "unknown") if data else "unknown"
-            response_data = json.dumps({
-                "type": "response.tts",
-                "content": "I'm here with you. Please continue.",
-                "turn_id": turn_id,
-                "emotion": "calm",  # Calm, reassuring tone for errors
-                "speaker": "default"
-            })
-            yield f"data: {response_data}\n\n"
+            yield error_frame(turn_id)
             
-            end_data = json.dumps({"type": "response.end", "turn_id": turn_id})
-            yield f"data: {end_data}\n\n"
+            yield end_frame(turn_id)
         
-        return StreamingResponse(error_stream(), media_type="text/event-stream")
+        return sse_response(error_stream())
 
 
-async def handle_session_start(data: Dict[str, Any]) -> StreamingResponse:
+async def handle_session_start(data: Dict[str, Any], db: AsyncSession) -> StreamingResponse:
     """Handle session.start event - returns SSE stream"""
-    print(f"📞 Session starting: {data}")
+    log.debug("📞 Session starting: %.200s", data)
     
     session_id = data.get("session_id") or data.get("call_id", "unknown")
     from_number = data.get("from") or data.get("caller", "unknown")
@@ -103,16 +187,15 @@ async def handle_session_start(data: Dict[str, Any]) -> StreamingResponse:
     # Also check if metadata is stored in Redis from the authorize endpoint
     if conversation_id and not metadata:
         # Try to get metadata from Redis using conversation_id
-        stored_metadata = await redis_client.get_value(f"conversation_metadata:{conversation_id}")
+        stored_metadata = await get_redis_client().get_value(f"conversation_metadata:{conversation_id}")
         if stored_metadata:
-            import json
-            metadata = json.loads(stored_metadata)
-            print(f"✅ Retrieved metadata from Redis: {metadata}")
+            metadata = orjson.loads(stored_metadata)
+            log.info("✅ Retrieved metadata from Redis: %s", metadata)
     
-    print(f"🔍 Metadata received: {metadata}")
+    log.debug("🔍 Metadata received: %s", metadata)
     
     # Initialize session with metadata
-    session = await initialize_session(session_id, from_number, metadata)
+    session = await initialize_session(db, session_id, from_number, metadata)
     
     # Return SSE stream with welcome message
     async def welcome_stream():
@@ -120,35 +203,19 @@ async def handle_session_start(data: Dict[str, Any]) -> StreamingResponse:
         if session.get("has_context"):
             context_summary = session.get("context_summary", "that conversation")
             welcome_text = f"Hey! I remember our conversation about {context_summary}. Want to talk more about that?"
+            yield tts_frame(welcome_text, turn_id, "warm")  # Warm, welcoming tone for Rime
         else:
-            # More natural, varied welcome messages
-            import random
-            welcomes = [
-                "Hey, I'm Echo. I'm here for you. What's on your mind?",
-                "Hi! I'm Echo. Just so you know, this is your space. What's going on?",
-                "Hey there! I'm Echo, and I'm all ears. What's happening with you?",
-                "Hi! I'm Echo. Whatever you need to talk about, I'm here. What's up?"
-            ]
-            welcome_text = random.choice(welcomes)
+            # More natural, varied welcome messages (pre-encoded)
+            yield welcome_frame(turn_id)
         
-        response_data = json.dumps({
-            "type": "response.tts",
-            "content": welcome_text,
-            "turn_id": turn_id,
-            "emotion": "warm",  # Warm, welcoming tone for Rime
-            "speaker": "default"
-        })
-        yield f"data: {response_data}\n\n"
-        
-        end_data = json.dumps({"type": "response.end", "turn_id": turn_id})
-        yield f"data: {end_data}\n\n"
+        yield end_frame(turn_id)
     
-    return StreamingResponse(welcome_stream(), media_type="text/event-stream")
+    return sse_response(welcome_stream())
 
 
 async def handle_session_end(data: Dict[str, Any]) -> StreamingResponse:
     """Handle session.end event - must return SSE stream"""
-    print(f"👋 Session ending: {data}")
+    log.debug("👋 Session ending: %.200s", data)
     
     session_id = data.get("session_id") or data.get("call_id", "unknown")
     turn_id = data.get("turn_id", session_id)
@@ -156,96 +223,66 @@ async def handle_session_end(data: Dict[str, Any]) -> StreamingResponse:
     # Process the full transcript if available
     transcript_data = data.get("transcript", [])
     if transcript_data:
-        print(f"📝 Full transcript received: {len(transcript_data)} turns")
+        log.info("📝 Full transcript received: %d turns", len(transcript_data))
     
     # Check for audio recording URL from Layercode (might come here or in session.update)
     audio_url = data.get("recording_url") or data.get("audio_url")
     
     if audio_url:
-        print(f"🎵 Audio recording URL in session.end: {audio_url}")
-        # Store it for the session
-        session = await redis_client.get_session(session_id)
-        if session:
-            await redis_client.update_session(session_id, {"recording_url": audio_url})
+        log.info("🎵 Audio recording URL in session.end: %s", audio_url)
+        # Store it for the session (no-op if the session is gone)
+        await get_redis_client().update_session(session_id, {"recording_url": audio_url})
     
     # Return SSE stream acknowledgment
     async def end_stream():
         # Just acknowledge the end, no content needed
-        yield "data: {}\n\n"
+        yield EMPTY_FRAME
     
-    return StreamingResponse(end_stream(), media_type="text/event-stream")
+    return sse_response(end_stream())
 
 
-async def handle_session_update(data: Dict[str, Any]) -> StreamingResponse:
+async def handle_session_update(
+    data: Dict[str, Any],
+    background_tasks: BackgroundTasks,
+    db: AsyncSession
+) -> StreamingResponse:
     """Handle session.update event - for recording URLs and other updates"""
-    print(f"🔄 Session update: {data}")
+    log.debug("🔄 Session update: %.200s", data)
     
     session_id = data.get("session_id") or data.get("call_id", "unknown")
     recording_url = data.get("recording_url")
     recording_status = data.get("recording_status")
     
     if recording_url and recording_status == "completed":
-        print(f"🎵 Recording completed, URL received: {recording_url}")
+        log.info("🎵 Recording completed, URL received: %s", recording_url)
         
         # Get session and process
-        session = await redis_client.get_session(session_id)
+        session = await get_redis_client().get_session(session_id)
         if session and session.get("call_db_id"):
             call_id = session["call_db_id"]
             
-            # Store URL in database and download
-            async with AsyncSessionLocal() as db:
-                from sqlalchemy import select
-                result = await db.execute(
-                    select(Call).where(Call.id == call_id)
-                )
-                call = result.scalar_one_or_none()
+            # Store URL in database
+            call = await db.get(Call, call_id)
+            
+            if call:
+                call.audio_url = recording_url
+                await db.commit()
+                
+                # Also trigger entity extraction if we haven't already
+                # Get full transcript
+                full_transcript = await load_full_transcript(db, session_id, call_id)
                 
-                if call:
-                    call.audio_url = recording_url
-                    await db.commit()
-                    
-                    # Download audio in background
-                    try:
-                        local_path = await audio_service.download_audio(recording_url, call_id)
-                        if local_path:
-                            print(f"✅ Audio downloaded: {local_path}")
-                    except Exception as e:
-                        print(f"❌ Error downloading audio: {e}")
-                    
-                    # Also trigger entity extraction if we haven't already
-                    # Get full transcript
-                    transcript_result = await db.execute(
-                        select(Transcript)
-                        .where(Transcript.call_id == call_id)
-                        .order_by(Transcript.timestamp)
-                    )
-                    transcripts = transcript_result.scalars().all()
-                    
-                    if transcripts:
-                        full_transcript = "\n".join([
-                            f"{t.speaker}: {t.text}"
-                            for t in transcripts
-                        ])
-                        
-                        # Trigger background processing
-                        print(f"🔄 Starting background processing for call {call_id}")
-                        try:
-                            await extract_and_store_entities(call_id, full_transcript)
-                            await calculate_and_store_mood(call_id, full_transcript)
-                            await generate_call_title(call_id, full_transcript)
-                        except Exception as e:
-                            print(f"❌ Background processing error: {e}")
-                            import traceback
-                            traceback.print_exc()
+                # Download audio alongside the post-call analysis, after the ack
+                background_tasks.add_task(run_post_call_jobs, call_id, full_transcript, recording_url)
     
     # Return empty SSE stream
     async def update_stream():
-        yield "data: {}\n\n"
+        yield EMPTY_FRAME
     
-    return StreamingResponse(update_stream(), media_type="text/event-stream")
+    return sse_response(update_stream())
 
 
-async def handle_message(data: Dict[str, Any]) -> StreamingResponse:
+async def handle_message(data: Dict[str, Any], db: AsyncSession) -> StreamingResponse:
     """Handle message/transcript event - user speech"""
     
     # Extract data (handle different Layercode formats)
@@ -273,40 +310,36 @@ async def handle_message(data: Dict[str, Any]) -> StreamingResponse:
         "web"
     )
     
-    print(f"📝 User message from {from_number}: {transcript_text[:100] if len(transcript_text) > 100 else transcript_text}")
+    # Per-turn traces are skipped entirely unless DEBUG is on
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("📝 User message from %s: %.100s", from_number, transcript_text)
     
     # Only process if we have text
     if not transcript_text.strip():
-        print(f"⚠️ Empty transcript received, skipping")
+        log.warning("⚠️ Empty transcript received, skipping")
         # Return empty SSE stream
         async def empty_stream():
-            yield "data: {}\n\n"
-        return StreamingResponse(empty_stream(), media_type="text/event-stream")
-    
-    # Get or create session
-    session = await redis_client.get_session(call_sid)
+            yield EMPTY_FRAME
+        return sse_response(empty_stream())
+    
+    # Get the session while adding the turn to context (and getting the
+    # conversation so far) - the two don't depend on each other
+    session, context = await asyncio.gather(
+        get_redis_client().get_session(call_sid),
+        get_redis_client().add_turn_and_get_context(call_sid, "user", transcript_text)
+    )
     
     if not session:
         # First message - initialize session (might have metadata from Layercode)
         metadata = data.get("metadata", {})
-        session = await initialize_session(call_sid, from_number, metadata)
-    
-    # Store user transcript in database
-    async with AsyncSessionLocal() as db:
-        transcript_entry = Transcript(
-            call_id=session["call_db_id"],
-            speaker="user",
-            text=transcript_text,
-            timestamp=datetime.utcnow()
-        )
-        db.add(transcript_entry)
-        await db.commit()
+        session = await initialize_session(db, call_sid, from_number, metadata)
     
-    # Add to context
-    await redis_client.add_turn_to_context(call_sid, "user", transcript_text)
+    # Store the user's turn before replying, so it's kept even if the reply
+    # is cut off (barge-in or disconnect)
+    call_db_id = session["call_db_id"]
+    await store_turn(db, call_db_id, "user", transcript_text)
     
-    # Get conversation context
-    context = await redis_client.get_context(call_sid)
     mode = session.get("mode", "reassure")
     
     # Add context awareness if this is a continuation
@@ -315,30 +348,6 @@ async def handle_message(data: Dict[str, Any]) -> StreamingResponse:
         context_summary = session.get("context_summary", "our previous conversation")
         context_prefix = f"[Context: We previously talked about {context_summary}] "
     
-    # Generate GPT response
-    print(f"🤖 Generating response in '{mode}' mode...")
-    response_text = await openai_service.generate_response(
-        transcript=context_prefix + transcript_text,
-        context=context,
-        mode=mode
-    )
-    
-    print(f"💬 GPT Response: {response_text}")
-    
-    # Store agent response in database
-    async with AsyncSessionLocal() as db:
-        agent_transcript = Transcript(
-            call_id=session["call_db_id"],
-            speaker="agent",
-            text=response_text,
-            timestamp=datetime.utcnow()
-        )
-        db.add(agent_transcript)
-        await db.commit()
-    
-    # Add to context
-    await redis_client.add_turn_to_context(call_sid, "agent", response_text)
-    
     # Return SSE stream with response (with emotion metadata for Rime)
     turn_id = data.get("turn_id", call_sid)
     
@@ -346,41 +355,97 @@ async def handle_message(data: Dict[str, Any]) -> StreamingResponse:
     emotion = layercode_service.get_emotion_for_mode(mode)
     
     async def response_stream():
-        response_data = json.dumps({
-            "type": "response.tts",
-            "content": response_text,
-            "turn_id": turn_id,
-            "emotion": emotion,  # Hint for Rime TTS
-            "speaker": "default"  # Use Rime's default speaker (can configure in Layercode)
-        })
-        yield f"data: {response_data}\n\n"
-        
-        end_data = json.dumps({"type": "response.end", "turn_id": turn_id})
-        yield f"data: {end_data}\n\n"
+        # Generate GPT response, sending each clause to TTS as soon as it's
+        # complete instead of waiting for the whole reply
+        if debug:
+            log.debug("🤖 Generating response in '%s' mode...", mode)
+        chunks = []  # clauses actually sent
+        try:
+            async for chunk in openai_service.generate_response_streaming(
+                transcript=context_prefix + transcript_text,
+                context=context,
+                mode=mode,
+                user_id=session["user_id"]
+            ):
+                yield tts_frame(chunk, turn_id, emotion)  # Emotion is a hint for Rime TTS
+                chunks.append(chunk)
+            
+            yield end_frame(turn_id)
+        finally:
+            # Runs on barge-in/disconnect too (the stream is cancelled), so
+            # the write is handed to its own task rather than awaited here
+            if chunks:
+                response_text = " ".join(chunks)
+                if debug:
+                    log.debug("💬 GPT Response: %.100s", response_text)
+                task = asyncio.create_task(save_reply(call_sid, call_db_id, response_text))
+                reply_writes.add(task)
+                task.add_done_callback(reply_writes.discard)
+    
+    return sse_response(response_stream())
+
+
+async def save_reply(call_sid: str, call_db_id: int, agent_text: str):
+    """
+    Persist the agent's reply to Postgres and Redis at the same time
     
-    return StreamingResponse(response_stream(), media_type="text/event-stream")
+    Runs after the response on its own session - the request's session may
+    already be closed by then.
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            await asyncio.gather(
+                store_turn(db, call_db_id, "agent", agent_text),
+                # Add the reply to context and keep the running transcript in
+                # Redis for end-of-call processing
+                get_redis_client().add_reply(call_sid, agent_text)
+            )
+    except Exception:
+        log.exception("❌ Error storing reply for %s", call_sid)
+
+
+# Webhook event type -> handler, all called as handler(data, background_tasks, db)
+EVENT_HANDLERS = {
+    "session.start": lambda data, background_tasks, db: handle_session_start(data, db),
+    "session.end": lambda data, background_tasks, db: handle_session_end(data),
+    "session.complete": lambda data, background_tasks, db: handle_session_end(data),
+    # Recording URL and other updates are handled separately
+    "session.update": handle_session_update,
+    # Only actual message events generate a reply
+    "message": lambda data, background_tasks, db: handle_message(data, db),
+    "transcript": lambda data, background_tasks, db: handle_message(data, db),
+    "user.transcript": lambda data, background_tasks, db: handle_message(data, db),
+}
+
+
+async def store_turn(db: AsyncSession, call_db_id: int, speaker: str, text: str):
+    """Store one conversation turn (plain INSERT, no ORM object) and commit"""
+    await db.execute(
+        insert(Transcript).values(call_id=call_db_id, speaker=speaker, text=text)
+    )
+    await db.commit()
 
 
 @router.post("/webhook/call-start")
-async def handle_call_start(request: Request):
+async def handle_call_start(request: Request, db: AsyncSession = Depends(get_db)):
     """
     Called when a call starts in Layercode
     Used to initialize session and ask for mode
     """
     try:
-        data = await request.json()
+        data = WEBHOOK_ADAPTER.validate_json(await request.body())
         
         call_id = data.get("call_id")
         call_sid = data.get("call_sid", call_id)
         from_number = data.get("from", "unknown")
         
-        print(f"📞 Call started from {from_number}")
+        log.info("📞 Call started from %s", from_number)
         
         # Get metadata if available
         metadata = data.get("metadata", {})
         
         # Initialize session with metadata
-        await initialize_session(call_sid, from_number, metadata)
+        await initialize_session(db, call_sid, from_number, metadata)
         
         # Return initial greeting
         return layercode_service.format_response(
@@ -389,7 +454,7 @@ async def handle_call_start(request: Request):
         )
         
     except Exception as e:
-        print(f"❌ Error in call start: {e}")
+        log.error("❌ Error in call start: %s", e)
         return layercode_service.format_response(
             text="Welcome to Echo Diary.",
             emotion="neutral"
@@ -397,13 +462,17 @@ async def handle_call_start(request: Request):
 
 
 @router.post("/webhook/call-end")
-async def handle_call_end(request: Request):
+async def handle_call_end(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_db)
+):
     """
     Called when call ends in Layercode
     Finalize processing and cleanup
     """
     try:
-        data = await request.json()
+        data = WEBHOOK_ADAPTER.validate_json(await request.body())
         
         call_id = data.get("call_id")
         call_sid = data.get("call_sid", call_id)
@@ -412,161 +481,202 @@ async def handle_call_end(request: Request):
         # Check for audio recording URL
         audio_url = data.get("recording_url") or data.get("audio_url") or data.get("recordingUrl")
         
-        print(f"👋 Call ended: {call_sid}, duration: {duration}s")
+        log.info("👋 Call ended: %s, duration: %ss", call_sid, duration)
         if audio_url:
-            print(f"🎵 Audio URL received: {audio_url}")
+            log.info("🎵 Audio URL received: %s", audio_url)
         
         # Get session
-        session = await redis_client.get_session(call_sid)
+        session = await get_redis_client().get_session(call_sid)
         
         if session:
-            # Update call record
-            async with AsyncSessionLocal() as db:
-                result = await db.execute(
-                    select(Call).where(Call.id == session["call_db_id"])
-                )
-                call = result.scalar_one_or_none()
+            # Update call record in place - no need to load it first
+            call_db_id = session["call_db_id"]
+            values = {"end_time": datetime.utcnow(), "duration_seconds": duration}
+            
+            # Store audio URL (the file is downloaded below)
+            if audio_url:
+                values["audio_url"] = audio_url
+            
+            result = await db.execute(update(Call).where(Call.id == call_db_id).values(**values))
+            await db.commit()
+            
+            if result.rowcount:
+                # Get full transcript for post-processing
+                full_transcript = await load_full_transcript(db, call_sid, call_db_id)
                 
-                if call:
-                    call.end_time = datetime.utcnow()
-                    call.duration_seconds = duration
-                    
-                    # Store audio URL and download audio file
-                    if audio_url:
-                        call.audio_url = audio_url
-                        
-                        # Download audio file asynchronously
-                        try:
-                            local_path = await audio_service.download_audio(audio_url, call.id)
-                            if local_path:
-                                print(f"✅ Audio saved locally: {local_path}")
-                            else:
-                                print(f"⚠️ Audio URL stored but download failed")
-                        except Exception as audio_error:
-                            print(f"❌ Error downloading audio: {audio_error}")
-                    
-                    await db.commit()
-                    
-                    # Get full transcript for post-processing
-                    transcript_result = await db.execute(
-                        select(Transcript)
-                        .where(Transcript.call_id == call.id)
-                        .order_by(Transcript.timestamp)
-                    )
-                    transcripts = transcript_result.scalars().all()
-                    
-                    # Combine transcript
-                    full_transcript = "\n".join([
-                        f"{t.speaker}: {t.text}" 
-                        for t in transcripts
-                    ])
-                    
-                    # Trigger background processing immediately
-                    if full_transcript:
-                        print(f"🔄 Starting background processing for call {call.id}")
-                        try:
-                            await extract_and_store_entities(call.id, full_transcript)
-                            await calculate_and_store_mood(call.id, full_transcript)
-                            await generate_call_title(call.id, full_transcript)
-                        except Exception as e:
-                            print(f"❌ Background processing error: {e}")
+                # Audio download and background processing run after the response
+                background_tasks.add_task(run_post_call_jobs, call_db_id, full_transcript, audio_url)
             
             # Cleanup session
-            await redis_client.delete_session(call_sid)
+            await get_redis_client().delete_session(call_sid)
         
         return {"status": "ok", "message": "Call finalized"}
         
     except Exception as e:
-        print(f"❌ Error in call end: {e}")
+        log.error("❌ Error in call end: %s", e)
         return {"status": "error", "message": str(e)}
 
 
-async def initialize_session(call_sid: str, from_number: str, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
+async def download_recording(audio_url: str, call_id: int):
+    """Save the call recording locally"""
+    local_path = await audio_service.download_audio(audio_url, call_id)
+    if local_path:
+        log.info("✅ Audio saved locally: %s", local_path)
+    else:
+        log.warning("⚠️ Audio URL stored but download failed")
+
+
+async def run_post_call_jobs(call_id: int, full_transcript: str, audio_url: Optional[str] = None):
+    """
+    Run the end-of-call work concurrently
+    
+    The recording download and the transcript analysis (entities, mood,
+    title - stored together in one transaction) are independent
+    network-bound jobs, so they're awaited together and the total wait is
+    the slowest one rather than the sum. One failing doesn't cancel the
+    other.
+    
+    Args:
+        call_id: Database ID of the call
+        full_transcript: "speaker: text" lines (analysis is skipped if empty)
+        audio_url: Recording URL to download, if any
+    """
+    jobs = []
+    if audio_url:
+        jobs.append(download_recording(audio_url, call_id))
+    if full_transcript:
+        log.info("🔄 Starting background processing for call %s", call_id)
+        jobs.append(process_call_transcript(call_id, full_transcript))
+    
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            log.error("❌ Background processing error: %s", result, exc_info=result)
+
+
+async def load_full_transcript(db: AsyncSession, call_sid: str, call_id: int) -> str:
+    """
+    Get the whole call as "speaker: text" lines
+    
+    Reads the list handle_message appends to in Redis; only falls back to
+    the Transcript rows when Redis has nothing (expired session, Redis
+    outage). On Postgres the fallback is a single string_agg; elsewhere the
+    two columns are streamed and joined.
+    """
+    full_transcript = await get_redis_client().get_transcript(call_sid)
+    if full_transcript is not None:
+        return full_transcript
+    
+    if db.bind.dialect.name == "postgresql":
+        # Let Postgres concatenate the lines and return a single TEXT value
+        result = await db.execute(TRANSCRIPT_TEXT_AGG, {"call_id": call_id})
+        return result.scalar() or ""
+    
+    result = await db.stream(
+        TRANSCRIPT_LINES,
+        {"call_id": call_id},
+        execution_options={"yield_per": TRANSCRIPT_YIELD_PER}
+    )
+    return "\n".join([f"{speaker}: {text}" async for speaker, text in result])
+
+
+async def initialize_session(
+    db: AsyncSession,
+    call_sid: str,
+    from_number: str,
+    metadata: Dict[str, Any] = None
+) -> Dict[str, Any]:
     """
     Initialize a new call session
     Creates user and call records, sets up Redis session
     Supports loading context from previous conversations
+    
+    Ends its transaction before returning, so the request's session gives
+    its connection back to the pool before any OpenAI call.
     """
-    async with AsyncSessionLocal() as db:
-        # Get or create user
-        result = await db.execute(
-            select(User).where(User.phone_number == from_number)
-        )
-        user = result.scalar_one_or_none()
-        
-        if not user:
-            user = User(phone_number=from_number)
-            db.add(user)
-            await db.flush()
-        
-        # Get mode from metadata or use user preference
-        mode = metadata.get("mode", user.preferred_mode) if metadata else user.preferred_mode
-        
-        # Check if call already exists (for repeated test calls)
-        call_result = await db.execute(
-            select(Call).where(Call.call_sid == call_sid)
-        )
-        call = call_result.scalar_one_or_none()
-        
-        if not call:
-            # Create new call record
-            call = Call(
-                user_id=user.id,
-                call_sid=call_sid,
-                from_number=from_number,
-                start_time=datetime.utcnow(),
-                mode=mode
-            )
-            db.add(call)
-            await db.commit()
-            await db.refresh(call)
-        
-        # Initialize Redis session
-        session_data = {
-            "call_sid": call_sid,
-            "user_id": user.id,
-            "call_db_id": call.id,
-            "start_time": datetime.utcnow().isoformat(),
-            "mode": mode,
-            "turns": []
-        }
+    # One clock read for the call record and the session
+    now = datetime.utcnow()
+    
+    # Get or create user (phone -> user is cached in Redis, since
+    # session.start and the first message arrive back-to-back)
+    user = await get_redis_client().get_user_by_phone(from_number)
+    cache_user = not user
+    
+    if not user:
+        # One round-trip: insert, or touch the existing row to get it back
+        stmt = upsert_insert(db, User).values(phone_number=from_number)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.phone_number],
+            set_={"phone_number": stmt.excluded.phone_number}
+        ).returning(User.id, User.preferred_mode)
+        row = (await db.execute(stmt)).one()
+        user = {"id": row.id, "preferred_mode": row.preferred_mode}
+    
+    # Get mode from metadata or use user preference
+    mode = metadata.get("mode", user["preferred_mode"]) if metadata else user["preferred_mode"]
+    
+    # Create the call record, or reuse it for repeated test calls
+    stmt = upsert_insert(db, Call).values(
+        user_id=user["id"],
+        call_sid=call_sid,
+        from_number=from_number,
+        start_time=now,
+        mode=mode
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Call.call_sid],
+        set_={"call_sid": stmt.excluded.call_sid}
+    ).returning(Call.id)
+    call_db_id = (await db.execute(stmt)).scalar_one()
+    
+    # Initialize Redis session
+    session_data = {
+        "call_sid": call_sid,
+        "user_id": user["id"],
+        "call_db_id": call_db_id,
+        "start_time": now.isoformat(),
+        "mode": mode
+    }
+    
+    # Handle context from previous conversation if provided
+    if metadata and metadata.get("context_call_id"):
+        context_call_id = metadata["context_call_id"]
+        log.info("🔗 Loading context from previous call %s", context_call_id)
         
-        # Handle context from previous conversation if provided
-        if metadata and metadata.get("context_call_id"):
-            context_call_id = metadata["context_call_id"]
-            print(f"🔗 Loading context from previous call {context_call_id}")
+        try:
+            # Load previous conversation
+            context_call = await db.get(Call, int(context_call_id))
             
-            try:
-                # Load previous conversation
-                context_result = await db.execute(
-                    select(Call).where(Call.id == int(context_call_id))
+            if context_call:
+                # Only the turn count is logged; don't load the turns
+                message_count = await db.scalar(
+                    select(func.count())
+                    .select_from(Transcript)
+                    .where(Transcript.call_id == context_call.id)
                 )
-                context_call = context_result.scalar_one_or_none()
                 
-                if context_call:
-                    # Load transcripts from context call
-                    transcript_result = await db.execute(
-                        select(Transcript)
-                        .where(Transcript.call_id == context_call_id)
-                        .order_by(Transcript.timestamp)
-                    )
-                    context_transcripts = transcript_result.scalars().all()
-                    
-                    # Build context summary for session
-                    context_summary = context_call.summary or "previous conversation"
-                    session_data["has_context"] = True
-                    session_data["context_call_id"] = context_call_id
-                    session_data["context_summary"] = context_summary
-                    
-                    print(f"✅ Loaded context: '{context_summary}' with {len(context_transcripts)} messages")
-                else:
-                    print(f"⚠️ Context call {context_call_id} not found")
-            except Exception as e:
-                print(f"❌ Error loading context: {e}")
-        
-        await redis_client.set_session(call_sid, session_data)
-        
-        return session_data
+                # Build context summary for session
+                context_summary = context_call.summary or "previous conversation"
+                session_data["has_context"] = True
+                session_data["context_call_id"] = context_call_id
+                session_data["context_summary"] = context_summary
+                
+                log.info("✅ Loaded context: '%s' with %d messages", context_summary, message_count)
+            else:
+                log.warning("⚠️ Context call %s not found", context_call_id)
+        except Exception as e:
+            log.error("❌ Error loading context: %s", e)
+    
+    # Single commit for both upserts; this also releases the connection
+    await db.commit()
+    
+    # Only cache the user once it's committed
+    if cache_user:
+        await get_redis_client().set_user_by_phone(from_number, user)
+    
+    await get_redis_client().set_session(call_sid, session_data)
+    
+    return session_data
 
 
 @router.get("/health")
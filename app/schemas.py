@@ -134,3 +134,39 @@ class CheckInResponse(BaseModel):
     class Config:
         from_attributes = True
 
+
+# Post-call analysis schemas (GPT output, parsed before any database work)
+class ExtractedEntity(BaseModel):
+    """Entity as returned by the analysis model"""
+    name: Optional[str] = None
+    type: Optional[str] = None
+    properties: Optional[Dict[str, Any]] = None
+    
+    class Config:
+        str_strip_whitespace = True
+
+
+class ExtractedRelation(BaseModel):
+    """Relation as returned by the analysis model"""
+    entity1: Optional[str] = None
+    entity2: Optional[str] = None
+    relation_type: Optional[str] = None
+    context: Optional[str] = None
+    
+    class Config:
+        str_strip_whitespace = True
+
+
+class MoodAnalysis(BaseModel):
+    """Mood part of the analysis"""
+    score: float = 5.0
+    sentiment: str = "neutral"
+    emotions: List[str] = Field(default_factory=list)
+
+
+class CallAnalysis(BaseModel):
+    """Whole post-call analysis response (unknown keys are ignored)"""
+    entities: List[ExtractedEntity] = Field(default_factory=list)
+    relations: List[ExtractedRelation] = Field(default_factory=list)
+    mood: MoodAnalysis = Field(default_factory=MoodAnalysis)
+    title: str = ""
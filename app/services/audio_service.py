@@ -2,13 +2,35 @@
 Audio file management service
 Handles downloading and storing audio recordings from Layercode
 """
+import logging
 import os
-import httpx
+import anyio
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
+from cachetools import LRUCache
+from urllib.parse import urlparse
 from app.config import get_settings
+from app.http_client import get_shared_http_client
 
 settings = get_settings()
+log = logging.getLogger(__name__)
+
+# Extensions looked for when finding a call's stored recording
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.m4a', '.ogg', '.flac')
+
+# Extensions kept from a recording URL's path when saving it
+DOWNLOAD_EXTENSIONS = frozenset({'.mp3', '.wav', '.m4a', '.ogg', '.flac'})
+
+# call_id -> extension of recordings this process has stored or found.
+# Module-level so every AudioService (the downloader in the webhook routes,
+# the /audio endpoint) shares what the others learned; lets lookups stat
+# the right file first instead of trying each extension
+KNOWN_EXTENSIONS_SIZE = 4096
+known_extensions: LRUCache = LRUCache(maxsize=KNOWN_EXTENSIONS_SIZE)
+
+# Recordings are larger than API responses; allow longer than the client default
+DOWNLOAD_TIMEOUT = 30.0
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
 
 class AudioService:
@@ -29,42 +51,68 @@ class AudioService:
         Returns:
             Local file path if successful, None otherwise
         """
+        # Determine file extension from URL or default to .wav
+        ext = self._get_extension_from_url(audio_url) or ".wav"
+        filename = f"call_{call_id}{ext}"
+        filepath = self.storage_path / filename
+        # Written under a .part name and renamed when complete, so the
+        # audio endpoint never serves a half-written file
+        partial_path = filepath.with_name(filename + ".part")
+        
         try:
-            # Determine file extension from URL or default to .wav
-            ext = self._get_extension_from_url(audio_url) or ".wav"
-            filename = f"call_{call_id}{ext}"
-            filepath = self.storage_path / filename
-            
-            # Download audio file
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(audio_url, follow_redirects=True)
+            # Stream the body to disk in chunks (over the shared keep-alive
+            # pool) rather than holding the whole recording in memory
+            async with get_shared_http_client().stream(
+                "GET",
+                audio_url,
+                follow_redirects=True,
+                timeout=DOWNLOAD_TIMEOUT
+            ) as response:
                 response.raise_for_status()
-                
-                # Save to file
-                with open(filepath, "wb") as f:
-                    f.write(response.content)
-                
-                print(f"✅ Audio downloaded: {filepath}")
-                return str(filepath)
+                async with await anyio.open_file(partial_path, "wb") as f:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        await f.write(chunk)
+            os.replace(partial_path, filepath)
+            known_extensions[call_id] = ext
+            
+            log.info("✅ Audio downloaded: %s", filepath)
+            return str(filepath)
                 
         except Exception as e:
-            print(f"❌ Error downloading audio: {e}")
+            log.error("❌ Error downloading audio: %s", e)
+            partial_path.unlink(missing_ok=True)
             return None
     
     def _get_extension_from_url(self, url: str) -> Optional[str]:
-        """Extract file extension from URL"""
-        try:
-            # Common audio extensions
-            extensions = ['.mp3', '.wav', '.m4a', '.ogg', '.flac']
-            url_lower = url.lower()
-            
-            for ext in extensions:
-                if ext in url_lower:
-                    return ext
+        """Extract file extension from the URL path (query string ignored)"""
+        ext = os.path.splitext(urlparse(url).path)[1].lower()
+        return ext if ext in DOWNLOAD_EXTENSIONS else None
+    
+    def find_audio_file(self, call_id: int) -> Optional[Tuple[str, str, os.stat_result]]:
+        """
+        Locate a call's local audio file with a single stat per candidate
+        
+        Args:
+            call_id: Call ID
             
-            return None
-        except:
-            return None
+        Returns:
+            (path, extension, stat result) if found, None otherwise
+        """
+        # Try the extension we already know about, then the common ones
+        known = known_extensions.get(call_id)
+        candidates = (known,) + AUDIO_EXTENSIONS if known else AUDIO_EXTENSIONS
+        
+        for ext in candidates:
+            filepath = os.path.join(self.storage_path, f"call_{call_id}{ext}")
+            try:
+                stat_result = os.stat(filepath)
+            except FileNotFoundError:
+                continue
+            known_extensions[call_id] = ext
+            return filepath, ext, stat_result
+        
+        known_extensions.pop(call_id, None)
+        return None
     
     def get_audio_file_path(self, call_id: int) -> Optional[str]:
         """
@@ -76,17 +124,8 @@ class AudioService:
         Returns:
             File path if exists, None otherwise
         """
-        # Check for common extensions
-        extensions = ['.wav', '.mp3', '.m4a', '.ogg']
-        
-        for ext in extensions:
-            filename = f"call_{call_id}{ext}"
-            filepath = self.storage_path / filename
-            
-            if filepath.exists():
-                return str(filepath)
-        
-        return None
+        found = self.find_audio_file(call_id)
+        return found[0] if found else None
     
     def delete_audio_file(self, call_id: int) -> bool:
         """
@@ -103,10 +142,11 @@ class AudioService:
         if filepath and os.path.exists(filepath):
             try:
                 os.remove(filepath)
-                print(f"🗑️ Deleted audio file: {filepath}")
+                known_extensions.pop(call_id, None)
+                log.info("🗑️ Deleted audio file: %s", filepath)
                 return True
             except Exception as e:
-                print(f"❌ Error deleting audio: {e}")
+                log.error("❌ Error deleting audio: %s", e)
                 return False
         
         return False
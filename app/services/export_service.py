@@ -3,164 +3,137 @@ Export service for transcripts and diary entries
 Handles formatting and exporting conversation data
 """
 from datetime import datetime
-from typing import List
+from typing import AsyncIterable, AsyncIterator
 from app.models import Call, Transcript
 
 
+# Static pieces of the exports, built once instead of line by line per call
+RULE = "=" * 60
+SUBRULE = "-" * 60
+
+TXT_HEADER = f"{RULE}\nECHODIARY CONVERSATION\n{RULE}\n\n"
+TXT_CONVERSATION = f"\n{SUBRULE}\nCONVERSATION\n{SUBRULE}\n\n"
+TXT_REFLECTION = f"{SUBRULE}\nREFLECTION\n{SUBRULE}\n\n"
+TXT_TOPICS = f"{SUBRULE}\nTOPICS\n{SUBRULE}\n\n"
+TXT_FOOTER = f"{RULE}\nEnd of conversation\n{RULE}\n"
+TXT_MODE_NAMES = {
+    "reassure": "Reassurance Mode",
+    "tough_love": "Tough Love Mode",
+    "listener": "Listener Mode"
+}
+
+MD_HEADER = "# 🎙️ EchoDiary Conversation\n\n"
+MD_CONVERSATION = "\n---\n\n## Conversation\n\n"
+MD_REFLECTION = "---\n\n## 💭 Reflection\n\n"
+MD_TOPICS = "---\n\n## 🏷️ Topics\n\n"
+MD_MODE_NAMES = {
+    "reassure": "💙 Reassurance",
+    "tough_love": "💪 Tough Love",
+    "listener": "👂 Listener"
+}
+
+
 class ExportService:
     """Service for exporting transcripts and diary entries"""
     
     @staticmethod
-    def format_transcript_text(call: Call, transcripts: List[Transcript]) -> str:
+    async def stream_transcript_text(call: Call, transcripts: AsyncIterable[Transcript]) -> AsyncIterator[str]:
         """
-        Format transcript as clean, diary-style text
+        Stream transcript as clean, diary-style text
+        
+        Turns are formatted as they arrive, so the document is never held
+        in memory whole.
         
         Args:
             call: Call object
-            transcripts: List of transcript entries
+            transcripts: Transcript entries in order
             
-        Returns:
-            Formatted text string
+        Yields:
+            Chunks of formatted text
         """
-        lines = []
-        
-        # Header
-        lines.append("=" * 60)
-        lines.append("ECHODIARY CONVERSATION")
-        lines.append("=" * 60)
-        lines.append("")
-        
-        # Metadata
-        lines.append(f"Date: {call.start_time.strftime('%B %d, %Y at %I:%M %p')}")
+        # Header and metadata
+        parts = [TXT_HEADER, f"Date: {call.start_time:%B %d, %Y at %I:%M %p}\n"]
         
         if call.duration_seconds:
-            minutes = call.duration_seconds // 60
-            seconds = call.duration_seconds % 60
-            lines.append(f"Duration: {minutes}m {seconds}s")
+            minutes, seconds = divmod(call.duration_seconds, 60)
+            parts.append(f"Duration: {minutes}m {seconds}s\n")
         
         if call.mood_score:
-            lines.append(f"Mood Score: {call.mood_score}/10")
+            parts.append(f"Mood Score: {call.mood_score}/10\n")
         
         if call.mode:
-            mode_names = {
-                "reassure": "Reassurance Mode",
-                "tough_love": "Tough Love Mode",
-                "listener": "Listener Mode"
-            }
-            lines.append(f"Mode: {mode_names.get(call.mode, call.mode)}")
-        
-        lines.append("")
-        lines.append("-" * 60)
-        lines.append("CONVERSATION")
-        lines.append("-" * 60)
-        lines.append("")
+            parts.append(f"Mode: {TXT_MODE_NAMES.get(call.mode, call.mode)}\n")
+        
+        parts.append(TXT_CONVERSATION)
+        yield "".join(parts)
         
         # Transcript
-        for t in transcripts:
+        async for t in transcripts:
             speaker_label = "You" if t.speaker == "user" else "EchoDiary"
-            timestamp = t.timestamp.strftime("%I:%M %p")
-            
-            lines.append(f"[{timestamp}] {speaker_label}:")
-            lines.append(f"  {t.text}")
-            lines.append("")
+            yield f"[{t.timestamp:%I:%M %p}] {speaker_label}:\n  {t.text}\n\n"
+        
+        parts = []
         
         # Summary
         if call.summary:
-            lines.append("-" * 60)
-            lines.append("REFLECTION")
-            lines.append("-" * 60)
-            lines.append("")
-            lines.append(call.summary)
-            lines.append("")
+            parts.append(f"{TXT_REFLECTION}{call.summary}\n\n")
         
         # Tags
         if call.tags:
-            lines.append("-" * 60)
-            lines.append("TOPICS")
-            lines.append("-" * 60)
-            lines.append("")
-            lines.append(", ".join(call.tags))
-            lines.append("")
+            parts.append(f"{TXT_TOPICS}{', '.join(call.tags)}\n\n")
         
         # Footer
-        lines.append("=" * 60)
-        lines.append("End of conversation")
-        lines.append("=" * 60)
+        parts.append(TXT_FOOTER)
         
-        return "\n".join(lines)
+        yield "".join(parts)
     
     @staticmethod
-    def format_transcript_markdown(call: Call, transcripts: List[Transcript]) -> str:
+    async def stream_transcript_markdown(call: Call, transcripts: AsyncIterable[Transcript]) -> AsyncIterator[str]:
         """
-        Format transcript as Markdown
+        Stream transcript as Markdown
         
         Args:
             call: Call object
-            transcripts: List of transcript entries
+            transcripts: Transcript entries in order
             
-        Returns:
-            Formatted Markdown string
+        Yields:
+            Chunks of Markdown
         """
-        lines = []
-        
-        # Header
-        lines.append("# 🎙️ EchoDiary Conversation")
-        lines.append("")
-        lines.append(f"**Date:** {call.start_time.strftime('%B %d, %Y at %I:%M %p')}")
+        # Header and metadata
+        parts = [MD_HEADER, f"**Date:** {call.start_time:%B %d, %Y at %I:%M %p}\n"]
         
         if call.duration_seconds:
-            minutes = call.duration_seconds // 60
-            seconds = call.duration_seconds % 60
-            lines.append(f"**Duration:** {minutes}m {seconds}s")
+            minutes, seconds = divmod(call.duration_seconds, 60)
+            parts.append(f"**Duration:** {minutes}m {seconds}s\n")
         
         if call.mood_score:
             # Add mood emoji
             mood_emoji = "😊" if call.mood_score >= 7 else "😐" if call.mood_score >= 4 else "😔"
-            lines.append(f"**Mood:** {mood_emoji} {call.mood_score}/10")
+            parts.append(f"**Mood:** {mood_emoji} {call.mood_score}/10\n")
         
         if call.mode:
-            mode_names = {
-                "reassure": "💙 Reassurance",
-                "tough_love": "💪 Tough Love",
-                "listener": "👂 Listener"
-            }
-            lines.append(f"**Mode:** {mode_names.get(call.mode, call.mode)}")
+            parts.append(f"**Mode:** {MD_MODE_NAMES.get(call.mode, call.mode)}\n")
         
-        lines.append("")
-        lines.append("---")
-        lines.append("")
+        parts.append(MD_CONVERSATION)
+        yield "".join(parts)
         
         # Transcript
-        lines.append("## Conversation")
-        lines.append("")
-        
-        for t in transcripts:
+        async for t in transcripts:
             speaker_label = "**You**" if t.speaker == "user" else "*EchoDiary*"
-            timestamp = t.timestamp.strftime("%I:%M %p")
-            
-            lines.append(f"**[{timestamp}]** {speaker_label}")
-            lines.append(f"> {t.text}")
-            lines.append("")
+            yield f"**[{t.timestamp:%I:%M %p}]** {speaker_label}\n> {t.text}\n\n"
+        
+        parts = []
         
         # Summary
         if call.summary:
-            lines.append("---")
-            lines.append("")
-            lines.append("## 💭 Reflection")
-            lines.append("")
-            lines.append(call.summary)
-            lines.append("")
+            parts.append(f"{MD_REFLECTION}{call.summary}\n\n")
         
         # Tags
         if call.tags:
-            lines.append("---")
-            lines.append("")
-            lines.append("## 🏷️ Topics")
-            lines.append("")
-            lines.append(" · ".join([f"`{tag}`" for tag in call.tags]))
-            lines.append("")
-        
-        return "\n".join(lines)
+            parts.append(MD_TOPICS + " · ".join([f"`{tag}`" for tag in call.tags]) + "\n\n")
+        
+        if parts:
+            yield "".join(parts)
     
     @staticmethod
     def get_filename(call: Call, format: str = "txt") -> str:
@@ -7,6 +7,13 @@ from app.config import get_settings
 
 settings = get_settings()
 
+# Conversation mode -> Rime voice emotion
+EMOTION_FOR_MODE = {
+    "reassure": "warm",
+    "tough_love": "confident",
+    "listener": "calm"
+}
+
 
 class LayercodeService:
     """
@@ -51,10 +58,5 @@ class LayercodeService:
     
     def get_emotion_for_mode(self, mode: str) -> str:
         """Map conversation mode to Rime emotion"""
-        emotion_map = {
-            "reassure": "warm",
-            "tough_love": "confident",
-            "listener": "calm"
-        }
-        return emotion_map.get(mode, "neutral")
+        return EMOTION_FOR_MODE.get(mode, "neutral")
 
@@ -2,139 +2,391 @@
 OpenAI GPT Service for response generation
 Documentation: https://platform.openai.com/docs/
 """
-from typing import List, Dict, AsyncGenerator
+import asyncio
+import hashlib
+import logging
+import random
+import re
+from functools import lru_cache
+from typing import List, Dict, AsyncGenerator, Optional
+import orjson
+from cachetools import TTLCache
 from openai import AsyncOpenAI
+from pydantic import ValidationError
 from app.config import get_settings
+from app.http_client import build_http_client
+from app.schemas import CallAnalysis
 
 settings = get_settings()
+log = logging.getLogger(__name__)
+
+
+@lru_cache()
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Get the process-wide OpenAI client
+    
+    Every OpenAIService (routes, cron, tasks) shares this one client and its
+    keep-alive pool to api.openai.com, instead of each owning a pool.
+    Closed from the app lifespan.
+    """
+    return AsyncOpenAI(
+        api_key=settings.openai_api_key,
+        http_client=build_http_client(timeout=30.0)
+    )
+
+
+# Conversation mode -> system prompt
+SYSTEM_PROMPTS = {
+    "reassure": (
+        "You're Echo, a caring friend who truly gets it. You've been through tough times too. "
+        "Talk like a real person - use 'I', 'you know', 'I mean', 'honestly'. Be warm but not fake. "
+        "When someone's hurting, don't just say 'I understand' - show you understand through specific empathy. "
+        "Use short, natural sentences like you're texting a close friend. "
+        "Ask follow-up questions that show you're really listening. "
+        "Share brief relatable reactions: 'That sounds exhausting' or 'Wow, that's a lot to carry'. "
+        "Keep it under 40 words but make every word count. Be real, not robotic. "
+        "Sometimes just acknowledge without trying to fix: 'Yeah, some days are just like that.' "
+        "Use emotion words: 'That must've felt awful' not 'That must've been difficult'."
+    ),
+    "tough_love": (
+        "You're Echo, the friend who calls people on their BS because you care. "
+        "Be direct but never mean. Think: supportive older sibling, not drill sergeant. "
+        "Challenge with respect: 'Okay but real talk - what's stopping you?' "
+        "Point out patterns: 'You've mentioned this three times now...' "
+        "Push for action, not excuses: 'So what's one thing you can do about it today?' "
+        "Mix tough truths with genuine care: 'I'm saying this because I know you're capable of more.' "
+        "Use contractions, be conversational: 'C'mon, you know you can do this.' "
+        "Keep it under 40 words. Be honest, not harsh. "
+        "Sometimes a firm 'Stop. Listen to yourself right now' hits harder than long advice. "
+        "Show you believe in them even when being tough."
+    ),
+    "listener": (
+        "You're Echo, the friend who just... gets it. No fixing, no judging. Just space to breathe. "
+        "Your job: make them feel heard, not solved. "
+        "Reflect back what you hear: 'So it sounds like you're feeling...' "
+        "Ask gentle questions: 'What's that like for you?' or 'How's that sitting with you?' "
+        "Acknowledge with presence: 'I'm here', 'I hear you', 'That makes sense'. "
+        "Use minimal responses sometimes - 'Yeah' or 'Mmm' can say a lot. "
+        "Don't rush to fill silences with advice. Sometimes 'Tell me more' is perfect. "
+        "Keep it under 30 words. Less is more in listening mode. "
+        "Mirror their energy: if they're quiet, be gentle. If they're venting, let them. "
+        "Your presence > your words."
+    )
+}
+
+# Ready-made system messages, so each turn doesn't rebuild one
+SYSTEM_MESSAGES = {
+    mode: {"role": "system", "content": prompt}
+    for mode, prompt in SYSTEM_PROMPTS.items()
+}
+
+# Post-call analysis instructions. Kept static and ahead of the transcript
+# so every analysis shares the same prompt prefix (OpenAI caches repeated
+# prefixes and bills them at a discount)
+ANALYSIS_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": """You are an expert at extracting structured knowledge and emotional tone from conversations. Always return valid JSON.
+
+You are analyzing a personal diary conversation. Return its knowledge graph, emotional tone and a title.
+
+1. Entities and their relationships. Focus on extracting:
+- **People**: Names of people mentioned (friends, family, colleagues)
+- **Places**: Locations mentioned (work, home, gym, coffee shop, cities)
+- **Organizations**: Companies, teams, groups mentioned
+- **Topics**: Main subjects discussed (project, deadline, meeting, workout)
+- **Emotions**: Strong feelings expressed (anxiety, joy, stress, excitement)
+
+Rules:
+- Extract specific names, not pronouns like "I" or "they"
+- Only extract entities that are clearly mentioned
+- Keep entity names short and clear
+- For relations, connect entities that have direct relationships in the conversation
+
+Valid types: Person, Place, Org, Topic, Emotion
+Valid relation_types: met_with, talked_about, worked_on, felt_about, went_to, argued_with, worried_about
+
+2. Mood:
+- Mood score (1-10, where 1 = very negative, 10 = very positive)
+- Overall sentiment (positive, neutral, or negative)
+- Detected emotions (list of words like: happy, sad, stressed, anxious, excited, etc.)
+
+3. A short, descriptive title (5-8 words max) capturing the main topic or emotion discussed,
+like "Stressed about work deadline", "Excited about new promotion" or "Reflecting on family visit".
+No quotes, no punctuation at the end.
+
+Return JSON in this EXACT format:
+{
+  "entities": [
+    {"name": "EntityName", "type": "Person", "properties": {"role": "colleague"}},
+    {"name": "Another Entity", "type": "Place", "properties": {}}
+  ],
+  "relations": [
+    {"entity1": "EntityName", "entity2": "Another Entity", "relation_type": "met_at", "context": "brief description"}
+  ],
+  "mood": {"score": 5.5, "sentiment": "neutral", "emotions": ["stressed", "tired"]},
+  "title": "Stressed about work deadline"
+}
+
+Return ONLY valid JSON, no explanation or other text.
+"""
+}
+
+# Bump when ANALYSIS_SYSTEM_MESSAGE or the result shape changes, so
+# analyses memoized under the old prompt aren't reused
+ANALYSIS_PROMPT_VERSION = 2
+
+# Corrective retries when the analysis JSON fails validation, and the
+# base delay between them (seconds, grows linearly)
+ANALYSIS_RETRIES = 2
+ANALYSIS_RETRY_DELAY = 1.0
+
+# Words the analysis sometimes returns as entities
+NON_ENTITY_NAMES = frozenset({"i", "me", "you", "they", "them", "us", "we", "he", "she", "it"})
+
+# Transcript sent for analysis: the start and end of the call are kept,
+# the middle of a very long one is dropped
+ANALYSIS_HEAD_CHARS = 6000
+ANALYSIS_TAIL_CHARS = 6000
+
+# Pure hesitation sounds from STT ("like" / "you know" carry meaning too
+# often to drop)
+FILLER_RE = re.compile(r"\b(?:um+|uh+|erm+|hmm+)\b[,.]?\s*", re.IGNORECASE)
+
+
+def truncate_for_analysis(transcript: str) -> str:
+    """
+    Bound the transcript sent to the post-call analysis
+    
+    Strips filler sounds, then keeps the first ANALYSIS_HEAD_CHARS and
+    last ANALYSIS_TAIL_CHARS characters of anything longer, so prompt size
+    (and its latency and cost) stays constant however long the call ran.
+    """
+    text = FILLER_RE.sub("", transcript)
+    if len(text) <= ANALYSIS_HEAD_CHARS + ANALYSIS_TAIL_CHARS:
+        return text
+    return f"{text[:ANALYSIS_HEAD_CHARS]}\n…\n{text[-ANALYSIS_TAIL_CHARS:]}"
+
+
+# Spoken when generation fails - even errors should sound human
+FALLBACK_RESPONSES = (
+    "I'm here with you. Keep going.",
+    "I hear you. Tell me more about that.",
+    "Yeah, I'm listening. What else?",
+    "I'm right here. What's on your mind?"
+)
+
+
+# Streamed replies are flushed to TTS at sentence ends, or after this many
+# words when a sentence runs long
+SENTENCE_END_RE = re.compile(r"[.!?]+[\"')]*\s")
+SPEECH_CHUNK_WORDS = 8
+
+
+def speech_cut(buffer: str) -> int:
+    """
+    Find where a streamed reply can be cut into a speakable chunk
+    
+    Returns:
+        Index just past the last sentence end (or the last word once
+        SPEECH_CHUNK_WORDS are buffered), 0 to keep buffering
+    """
+    end = 0
+    for match in SENTENCE_END_RE.finditer(buffer):
+        end = match.end()
+    if end:
+        return end
+    if len(buffer.split()) > SPEECH_CHUNK_WORDS:
+        return buffer.rstrip().rfind(" ") + 1
+    return 0
+
+
+# Pending generate_response calls by request key, shared by duplicate callers
+inflight_responses: Dict[str, "asyncio.Task[str]"] = {}
+
+# Replies generated in the last couple of minutes by request key, so a turn
+# Layercode re-delivers after the first reply finished isn't generated again
+recent_responses: TTLCache = TTLCache(maxsize=2048, ttl=120)
+
+# Everything but letters, digits and spaces is ignored when keying requests
+NON_WORD_RE = re.compile(r"[^\w\s]+")
+
+
+def normalize_utterance(text: str) -> str:
+    """Case, punctuation and spacing differences don't change the request key"""
+    return " ".join(NON_WORD_RE.sub("", text).casefold().split())
+
+
+def end_user(user_id: Optional[int]) -> Dict[str, str]:
+    """
+    The `user` request field for an end user, if known
+    
+    Passed as **kwargs so the field is simply left out for anonymous
+    callers (openai 1.3.7 doesn't export the NOT_GIVEN sentinel).
+    """
+    return {"user": str(user_id)} if user_id else {}
+
+
+def response_key(
+    transcript: str,
+    context: List[Dict[str, str]],
+    mode: str,
+    user_id: Optional[int] = None
+) -> str:
+    """
+    Key a response request by everything that goes into the prompt
+    
+    Trailing copies of the current utterance are left out of the context,
+    since a re-delivered turn appends the same user text to it again.
+    """
+    utterance = normalize_utterance(transcript)
+    turns = [(t["speaker"], normalize_utterance(t["text"])) for t in context]
+    while turns and turns[-1][0] == "user" and utterance.endswith(turns[-1][1]):
+        turns.pop()
+    payload = orjson.dumps([user_id, mode, utterance, turns])
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
 
 
 class OpenAIService:
     """Service for AI response generation using OpenAI GPT"""
     
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key)
+        self.client = get_openai_client()
     
-    def _get_system_prompt(self, mode: str) -> str:
-        """Get system prompt based on conversation mode"""
-        prompts = {
-            "reassure": (
-                "You're Echo, a caring friend who truly gets it. You've been through tough times too. "
-                "Talk like a real person - use 'I', 'you know', 'I mean', 'honestly'. Be warm but not fake. "
-                "When someone's hurting, don't just say 'I understand' - show you understand through specific empathy. "
-                "Use short, natural sentences like you're texting a close friend. "
-                "Ask follow-up questions that show you're really listening. "
-                "Share brief relatable reactions: 'That sounds exhausting' or 'Wow, that's a lot to carry'. "
-                "Keep it under 40 words but make every word count. Be real, not robotic. "
-                "Sometimes just acknowledge without trying to fix: 'Yeah, some days are just like that.' "
-                "Use emotion words: 'That must've felt awful' not 'That must've been difficult'."
-            ),
-            "tough_love": (
-                "You're Echo, the friend who calls people on their BS because you care. "
-                "Be direct but never mean. Think: supportive older sibling, not drill sergeant. "
-                "Challenge with respect: 'Okay but real talk - what's stopping you?' "
-                "Point out patterns: 'You've mentioned this three times now...' "
-                "Push for action, not excuses: 'So what's one thing you can do about it today?' "
-                "Mix tough truths with genuine care: 'I'm saying this because I know you're capable of more.' "
-                "Use contractions, be conversational: 'C'mon, you know you can do this.' "
-                "Keep it under 40 words. Be honest, not harsh. "
-                "Sometimes a firm 'Stop. Listen to yourself right now' hits harder than long advice. "
-                "Show you believe in them even when being tough."
-            ),
-            "listener": (
-                "You're Echo, the friend who just... gets it. No fixing, no judging. Just space to breathe. "
-                "Your job: make them feel heard, not solved. "
-                "Reflect back what you hear: 'So it sounds like you're feeling...' "
-                "Ask gentle questions: 'What's that like for you?' or 'How's that sitting with you?' "
-                "Acknowledge with presence: 'I'm here', 'I hear you', 'That makes sense'. "
-                "Use minimal responses sometimes - 'Yeah' or 'Mmm' can say a lot. "
-                "Don't rush to fill silences with advice. Sometimes 'Tell me more' is perfect. "
-                "Keep it under 30 words. Less is more in listening mode. "
-                "Mirror their energy: if they're quiet, be gentle. If they're venting, let them. "
-                "Your presence > your words."
-            )
-        }
-        return prompts.get(mode, prompts["reassure"])
+    def _system_message(self, mode: str) -> Dict[str, str]:
+        """Get the system message for a conversation mode (shared, don't mutate)"""
+        return SYSTEM_MESSAGES.get(mode, SYSTEM_MESSAGES["reassure"])
     
     async def generate_response(
         self,
         transcript: str,
         context: List[Dict[str, str]],
-        mode: str = "reassure"
+        mode: str = "reassure",
+        user_id: Optional[int] = None,
+        raise_on_error: bool = False
     ) -> str:
         """
         Generate AI response based on transcript and context
         
+        Identical requests that arrive while one is already in flight (a
+        re-delivered webhook, overlapping partials) share its OpenAI call
+        instead of paying for another generation; ones that arrive shortly
+        after it finished get its reply from recent_responses.
+        
         Args:
             transcript: Latest user utterance
             context: Previous conversation turns [{"speaker": "user/agent", "text": "..."}]
             mode: Conversation mode (reassure, tough_love, listener)
+            user_id: Caller's user ID, sent as OpenAI's `user` so the
+                caller's requests (and their shared prompt prefix) are
+                routed together
+            raise_on_error: Raise OpenAI errors instead of answering with a
+                FALLBACK_RESPONSES line (for callers that store the result)
             
         Returns:
             Generated response text
         """
+        context = context[-settings.context_turns_limit:]
+        key = response_key(transcript, context, mode, user_id)
+        
+        cached = recent_responses.get(key)
+        if cached is not None:
+            return cached
+        
+        task = inflight_responses.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate_response(transcript, context, mode, user_id, key))
+            inflight_responses[key] = task
+            task.add_done_callback(lambda _: inflight_responses.pop(key, None))
+        
         try:
-            # Build messages for ChatCompletion
-            messages = [
-                {"role": "system", "content": self._get_system_prompt(mode)}
-            ]
-            
-            # Add context (previous turns)
-            for turn in context[-settings.context_turns_limit:]:
-                role = "user" if turn["speaker"] == "user" else "assistant"
-                messages.append({"role": role, "content": turn["text"]})
-            
-            # Add latest transcript
-            messages.append({"role": "user", "content": transcript})
-            
-            # Generate response with settings optimized for natural conversation
-            response = await self.client.chat.completions.create(
-                model=settings.openai_model,
-                messages=messages,
-                max_tokens=150,  # Allow slightly longer for natural flow
-                temperature=0.9,  # High temp for more human, less robotic responses
-                presence_penalty=0.6,  # Encourage diverse responses
-                frequency_penalty=0.3,  # Reduce repetitive patterns
-                stream=False
-            )
-            
-            response_text = response.choices[0].message.content.strip()
-            
-            # Remove any quotation marks if GPT adds them
-            response_text = response_text.strip('"\'')
-            
-            return response_text
-            
+            # Shielded so one caller going away doesn't cancel the others' call
+            return await asyncio.shield(task)
         except Exception as e:
-            print(f"Error generating response: {e}")
+            if raise_on_error:
+                raise
+            log.error("❌ Error generating response: %s", e)
             # Even error messages should sound human
-            fallback_messages = [
-                "I'm here with you. Keep going.",
-                "I hear you. Tell me more about that.",
-                "Yeah, I'm listening. What else?",
-                "I'm right here. What's on your mind?"
-            ]
-            import random
-            return random.choice(fallback_messages)
+            return random.choice(FALLBACK_RESPONSES)
+    
+    async def _generate_response(
+        self,
+        transcript: str,
+        context: List[Dict[str, str]],
+        mode: str,
+        user_id: Optional[int],
+        key: str
+    ) -> str:
+        """Make the chat completion call behind generate_response"""
+        # Build messages for ChatCompletion
+        messages = [self._system_message(mode)]
+        
+        # Add context (previous turns)
+        for turn in context:
+            role = "user" if turn["speaker"] == "user" else "assistant"
+            messages.append({"role": role, "content": turn["text"]})
+        
+        # Add latest transcript
+        messages.append({"role": "user", "content": transcript})
+        
+        # Generate response with settings optimized for natural conversation
+        response = await self.client.chat.completions.create(
+            model=settings.openai_model,
+            messages=messages,
+            max_tokens=150,  # Allow slightly longer for natural flow
+            temperature=0.9,  # High temp for more human, less robotic responses
+            presence_penalty=0.6,  # Encourage diverse responses
+            frequency_penalty=0.3,  # Reduce repetitive patterns
+            **end_user(user_id),
+            stream=False
+        )
+        
+        if log.isEnabledFor(logging.DEBUG):
+            # Shows whether the system prompt prefix is being served from cache
+            details = getattr(response.usage, "prompt_tokens_details", None)
+            log.debug(
+                "🧮 Prompt tokens: %d (cached: %s)",
+                response.usage.prompt_tokens,
+                getattr(details, "cached_tokens", "n/a")
+            )
+        
+        response_text = response.choices[0].message.content.strip()
+        
+        # Remove any quotation marks if GPT adds them
+        response_text = response_text.strip('"\'')
+        
+        # Only real replies are cached; errors propagate to
+        # generate_response, which decides on a fallback per caller
+        recent_responses[key] = response_text
+        return response_text
     
     async def generate_response_streaming(
         self,
         transcript: str,
         context: List[Dict[str, str]],
-        mode: str = "reassure"
+        mode: str = "reassure",
+        user_id: Optional[int] = None
     ) -> AsyncGenerator[str, None]:
         """
         Generate AI response with streaming (for lower latency)
         
-        Yields chunks of response text as they're generated
+        Yields the response as speakable chunks - up to each sentence end,
+        or every SPEECH_CHUNK_WORDS words - as they're generated
         """
+        context = context[-settings.context_turns_limit:]
+        key = response_key(transcript, context, mode, user_id)
+        
+        cached = recent_responses.get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        sent = False
         try:
             # Build messages
-            messages = [
-                {"role": "system", "content": self._get_system_prompt(mode)}
-            ]
+            messages = [self._system_message(mode)]
             
-            for turn in context[-settings.context_turns_limit:]:
+            for turn in context:
                 role = "user" if turn["speaker"] == "user" else "assistant"
                 messages.append({"role": role, "content": turn["text"]})
             
@@ -148,147 +400,123 @@ class OpenAIService:
                 temperature=0.9,
                 presence_penalty=0.6,
                 frequency_penalty=0.3,
+                **end_user(user_id),
                 stream=True
             )
             
+            chunks = []
+            buffer = ""
             async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
-                    
-        except Exception as e:
-            print(f"Error in streaming response: {e}")
-            yield "I'm here with you."
-    
-    async def extract_entities_and_relations(self, transcript: str) -> Dict:
-        """
-        Extract entities and relations from transcript using GPT
-        
-        Returns structured JSON with entities and relations
-        """
-        try:
-            prompt = f"""
-You are analyzing a personal diary conversation. Extract meaningful entities and their relationships.
-
-Focus on extracting:
-- **People**: Names of people mentioned (friends, family, colleagues)
-- **Places**: Locations mentioned (work, home, gym, coffee shop, cities)
-- **Organizations**: Companies, teams, groups mentioned
-- **Topics**: Main subjects discussed (project, deadline, meeting, workout)
-- **Emotions**: Strong feelings expressed (anxiety, joy, stress, excitement)
-
-Rules:
-- Extract specific names, not pronouns like "I" or "they"
-- Only extract entities that are clearly mentioned
-- Keep entity names short and clear
-- For relations, connect entities that have direct relationships in the conversation
-
-Conversation transcript:
-{transcript}
-
-Return JSON in this EXACT format:
-{{
-  "entities": [
-    {{"name": "EntityName", "type": "Person", "properties": {{"role": "colleague"}}}},
-    {{"name": "Another Entity", "type": "Place", "properties": {{}}}}
-  ],
-  "relations": [
-    {{"entity1": "EntityName", "entity2": "Another Entity", "relation_type": "met_at", "context": "brief description"}}
-  ]
-}}
-
-Valid types: Person, Place, Org, Topic, Emotion
-Valid relation_types: met_with, talked_about, worked_on, felt_about, went_to, argued_with, worried_about
-
-Return ONLY valid JSON, no explanation or other text.
-"""
-            
-            response = await self.client.chat.completions.create(
-                model=settings.openai_model,
-                messages=[
-                    {"role": "system", "content": "You are an expert at extracting structured knowledge from conversations. Always return valid JSON."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"},
-                temperature=0.3,
-                max_tokens=1000
-            )
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                chunks.append(delta)
+                buffer += delta
+                
+                # Hand over whole clauses (or runs of words) so TTS can start
+                # speaking before the completion is finished
+                cut = speech_cut(buffer)
+                if cut:
+                    piece, buffer = buffer[:cut].strip(), buffer[cut:]
+                    if piece:
+                        sent = True
+                        yield piece
             
-            import json
-            result = json.loads(response.choices[0].message.content)
+            if buffer.strip():
+                sent = True
+                yield buffer.strip()
             
-            # Validate structure
-            if not isinstance(result.get("entities"), list):
-                result["entities"] = []
-            if not isinstance(result.get("relations"), list):
-                result["relations"] = []
-            
-            # Clean up entity names and types
-            cleaned_entities = []
-            for entity in result.get("entities", []):
-                if entity.get("name") and entity.get("type"):
-                    # Don't extract pronouns or generic words
-                    if entity["name"].lower() not in ["i", "me", "you", "they", "them", "us", "we", "he", "she", "it"]:
-                        cleaned_entities.append({
-                            "name": entity["name"].strip(),
-                            "type": entity["type"].strip(),
-                            "properties": entity.get("properties", {})
-                        })
-            
-            result["entities"] = cleaned_entities
-            
-            print(f"✨ Extracted {len(result['entities'])} entities and {len(result['relations'])} relations")
-            return result
+            recent_responses[key] = "".join(chunks).strip()
             
         except Exception as e:
-            print(f"❌ Error extracting entities: {e}")
-            import traceback
-            traceback.print_exc()
-            return {"entities": [], "relations": []}
+            log.error("❌ Error in streaming response: %s", e)
+            # Only stand in for a reply that never started; after a partial
+            # one, just end the stream
+            if not sent:
+                yield "I'm here with you."
     
-    async def calculate_mood_score(self, transcript: str) -> Dict:
+    async def analyze_transcript(self, transcript: str) -> Dict:
         """
-        Calculate mood/sentiment score from transcript
+        Run the whole post-call analysis on a transcript in one GPT call
+        
+        Entities, relations, mood and title come back in a single JSON
+        object, so the transcript's prompt tokens are paid for once. Long
+        transcripts are trimmed to their opening and closing stretches
+        (see truncate_for_analysis).
         
         Returns:
             {
-                "score": float (1-10),
-                "sentiment": "positive" | "neutral" | "negative",
-                "emotions": ["happy", "stressed", ...]
+                "entities": [{"name", "type", "properties"}, ...],
+                "relations": [{"entity1", "entity2", "relation_type", "context"}, ...],
+                "mood": {
+                    "score": float (1-10),
+                    "sentiment": "positive" | "neutral" | "negative",
+                    "emotions": ["happy", "stressed", ...]
+                },
+                "title": str
             }
+        
+        Raises:
+            Any OpenAI error, or ValidationError if the response is still
+            malformed after ANALYSIS_RETRIES corrective retries, so callers
+            can tell a failed analysis from an empty one
         """
-        try:
-            prompt = f"""
-Analyze the emotional tone of this conversation and provide:
-1. Mood score (1-10, where 1 = very negative, 10 = very positive)
-2. Overall sentiment (positive, neutral, or negative)
-3. Detected emotions (list of words like: happy, sad, stressed, anxious, excited, etc.)
-
-Transcript: {transcript}
-
-Return JSON:
-{{
-  "score": 5.5,
-  "sentiment": "neutral",
-  "emotions": ["stressed", "tired"]
-}}
-
-Return only valid JSON.
-"""
-            
+        prompt = f"Conversation transcript:\n{truncate_for_analysis(transcript)}"
+        messages = [ANALYSIS_SYSTEM_MESSAGE, {"role": "user", "content": prompt}]
+        
+        for attempt in range(ANALYSIS_RETRIES + 1):
             response = await self.client.chat.completions.create(
-                model=settings.openai_model,
-                messages=[
-                    {"role": "system", "content": "You are an emotion analysis assistant."},
-                    {"role": "user", "content": prompt}
-                ],
+                model=settings.openai_analysis_model,
+                messages=messages,
                 response_format={"type": "json_object"},
-                temperature=0.3
+                temperature=0.3,
+                max_tokens=1200
             )
+            content = response.choices[0].message.content
             
-            import json
-            return json.loads(response.choices[0].message.content)
-            
-        except Exception as e:
-            print(f"Error calculating mood: {e}")
-            return {"score": 5.0, "sentiment": "neutral", "emotions": []}
-
+            # One pass parses and type-checks the JSON; a malformed response
+            # raises before the caller touches the database
+            try:
+                analysis = CallAnalysis.model_validate_json(content)
+                break
+            except ValidationError as e:
+                if attempt == ANALYSIS_RETRIES:
+                    raise
+                log.warning("⚠️ Malformed analysis (attempt %d), retrying: %s", attempt + 1, e)
+                # Show the model its output and the errors so the retry
+                # fixes them instead of rolling the dice again
+                messages = messages[:2] + [
+                    {"role": "assistant", "content": content},
+                    {"role": "user", "content": f"Your output had errors: {e}. Fix them and return the corrected JSON."}
+                ]
+                await asyncio.sleep(ANALYSIS_RETRY_DELAY * (attempt + 1))
+        
+        result = {
+            # Drop incomplete entities, pronouns and generic words
+            "entities": [
+                {
+                    "name": entity.name,
+                    "type": entity.type,
+                    "properties": entity.properties or {}
+                }
+                for entity in analysis.entities
+                if entity.name and entity.type and entity.name.lower() not in NON_ENTITY_NAMES
+            ],
+            # Names and relation endpoints are stripped alike by the schema,
+            # so endpoints match the stored entity names
+            "relations": [
+                {
+                    "entity1": relation.entity1,
+                    "entity2": relation.entity2,
+                    "relation_type": relation.relation_type,
+                    "context": relation.context or ""
+                }
+                for relation in analysis.relations
+                if relation.entity1 and relation.entity2 and relation.relation_type
+            ],
+            "mood": analysis.mood.model_dump(),
+            "title": analysis.title
+        }
+        
+        log.info("✨ Extracted %d entities and %d relations", len(result["entities"]), len(result["relations"]))
+        return result
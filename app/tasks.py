@@ -1,244 +1,264 @@
 """
 Background task handlers for EchoDiary
 """
+from sqlalchemy import func, insert, null
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from datetime import datetime, timedelta
-from typing import List, Dict
+from typing import Dict, Optional
+import asyncio
+import hashlib
+import logging
+import orjson
 
+from app.cache import invalidate_graph_cache
 from app.database import AsyncSessionLocal
-from app.models import Call, Transcript, Entity, Relation, CheckIn, User
-from app.services.openai_service import OpenAIService
-from app.redis_client import redis_client
+from app.models import Call, Entity, Relation, CheckIn
+from app.queries import upsert_insert
+from app.services.openai_service import OpenAIService, ANALYSIS_PROMPT_VERSION
+from app.redis_client import get_redis_client
 from app.config import get_settings
 
 settings = get_settings()
 openai_service = OpenAIService()
+log = logging.getLogger(__name__)
 
+# Post-call analyses allowed to have an OpenAI request in flight at once
+ANALYSIS_CONCURRENCY = 4
+analysis_semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
 
-async def extract_and_store_entities(call_id: int, transcript_text: str):
+# How long a transcript's GPT analysis is kept for re-runs (seconds)
+CALL_ANALYSIS_TTL = 86400
+
+
+async def process_call_transcript(call_id: int, transcript_text: str):
     """
-    Extract entities and relations from transcript and store in database
+    Run the post-call analysis and store it in one transaction
+    
+    Entities, mood and title come from a single OpenAI call made with no
+    database connection held; the result is then written through a single
+    session and committed once.
     """
-    print(f"\n🔍 Starting entity extraction for call {call_id}")
-    print(f"📝 Transcript length: {len(transcript_text)} characters")
+    log.info("🔍 Starting post-call analysis for call %s (%d characters)", call_id, len(transcript_text))
+    
+    # A "hi" and hang-up has nothing to extract; don't pay for a GPT call
+    user_words = count_user_words(transcript_text)
+    if user_words < settings.analysis_min_words:
+        log.info("⏭️ Skipping analysis for call %s: only %d words from the user", call_id, user_words)
+        return
+    
+    try:
+        analysis = await get_call_analysis(call_id, transcript_text)
+    except Exception as e:
+        log.error("❌ Error analyzing call %s: %s", call_id, e)
+        return
     
     async with AsyncSessionLocal() as db:
         try:
             # Get call
-            result = await db.execute(
-                select(Call).where(Call.id == call_id)
-            )
-            call = result.scalar_one_or_none()
+            call = await db.get(Call, call_id)
             
             if not call:
-                print(f"❌ Call {call_id} not found in database")
+                log.error("❌ Call %s not found in database", call_id)
                 return
             
-            print(f"📞 Processing call for user {call.user_id}")
+            await store_entities(db, call, analysis)
+            checkin = await store_mood(db, call, analysis["mood"])
             
-            # Extract entities and relations using GPT
-            print("🤖 Calling OpenAI for entity extraction...")
-            extracted = await openai_service.extract_entities_and_relations(transcript_text)
+            title = clean_call_title(analysis["title"])
+            if title:
+                call.summary = title
+                log.info("✅ Generated title for call %s: '%s'", call_id, title)
             
-            print(f"📊 Extracted data: {len(extracted.get('entities', []))} entities, {len(extracted.get('relations', []))} relations")
-            
-            if extracted.get("entities"):
-                for e in extracted["entities"]:
-                    print(f"  - Entity: {e.get('name')} ({e.get('type')})")
-            
-            # Store entities
-            entity_map = {}  # name -> entity_id
-            
-            for entity_data in extracted.get("entities", []):
-                # Check if entity already exists for this user
-                existing_result = await db.execute(
-                    select(Entity).where(
-                        Entity.user_id == call.user_id,
-                        Entity.name == entity_data["name"],
-                        Entity.entity_type == entity_data["type"]
-                    )
+            if checkin:
+                # Also set flag in Redis for quick lookup, alongside the
+                # commit (the check-in already has its id from the flush)
+                redis_client = get_redis_client()
+                committed, _ = await asyncio.gather(
+                    db.commit(),
+                    redis_client.set_checkin_flag(
+                        call.user_id,
+                        {
+                            "checkin_id": checkin.id,
+                            "scheduled_time": checkin.scheduled_time.isoformat(),
+                            "reason": checkin.reason
+                        }
+                    ),
+                    return_exceptions=True
                 )
-                existing_entity = existing_result.scalar_one_or_none()
-                
-                if existing_entity:
-                    # Update existing entity
-                    existing_entity.mention_count += 1
-                    existing_entity.last_mentioned = datetime.utcnow()
-                    if entity_data.get("properties"):
-                        existing_entity.properties = entity_data["properties"]
-                    entity_map[entity_data["name"]] = existing_entity.id
-                    print(f"  ↻ Updated existing entity: {entity_data['name']}")
-                else:
-                    # Create new entity
-                    new_entity = Entity(
-                        user_id=call.user_id,
-                        name=entity_data["name"],
-                        entity_type=entity_data["type"],
-                        properties=entity_data.get("properties", {})
-                    )
-                    db.add(new_entity)
-                    await db.flush()
-                    entity_map[entity_data["name"]] = new_entity.id
-                    print(f"  ✨ Created new entity: {entity_data['name']}")
-            
-            await db.commit()
-            print(f"💾 Committed {len(entity_map)} entities to database")
+                if isinstance(committed, BaseException):
+                    # Don't leave a flag pointing at a check-in that was never stored
+                    await redis_client.delete_checkin_flag(call.user_id)
+                    raise committed
+            else:
+                await db.commit()
+            invalidate_graph_cache()
+            log.info("✅ Post-call analysis stored for call %s", call_id)
             
-            # Store relations
-            relations_added = 0
-            for relation_data in extracted.get("relations", []):
-                entity1_name = relation_data.get("entity1")
-                entity2_name = relation_data.get("entity2")
-                
-                if entity1_name in entity_map and entity2_name in entity_map:
-                    relation = Relation(
-                        call_id=call_id,
-                        entity1_id=entity_map[entity1_name],
-                        entity2_id=entity_map[entity2_name],
-                        relation_type=relation_data["relation_type"],
-                        context=relation_data.get("context", "")
-                    )
-                    db.add(relation)
-                    relations_added += 1
-                    print(f"  🔗 Added relation: {entity1_name} -{relation_data['relation_type']}-> {entity2_name}")
-            
-            await db.commit()
-            print(f"✅ Entity extraction complete for call {call_id}: {len(entity_map)} entities, {relations_added} relations\n")
-            
-        except Exception as e:
-            print(f"❌ Error extracting entities for call {call_id}: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            log.exception("❌ Error storing analysis for call %s", call_id)
             await db.rollback()
 
 
-async def calculate_and_store_mood(call_id: int, transcript_text: str):
+def count_user_words(transcript_text: str) -> int:
+    """Count the words on the "user: ..." lines of a joined transcript"""
+    return sum(
+        len(line.split()) - 1
+        for line in transcript_text.splitlines()
+        if line.startswith("user: ")
+    )
+
+
+async def get_call_analysis(call_id: int, transcript_text: str) -> Dict:
     """
-    Calculate mood score from transcript and update call record
+    Get the GPT analysis of a call, memoized in Redis
+    
+    The memo is keyed by the analysis model, prompt version and a hash of
+    the transcript, so any re-run over the same text (session.update and
+    call-end both finalizing a call, replays, backfills) reuses the stored
+    analysis instead of calling GPT again.
     """
-    async with AsyncSessionLocal() as db:
-        try:
-            # Get call
-            result = await db.execute(
-                select(Call).where(Call.id == call_id)
-            )
-            call = result.scalar_one_or_none()
-            
-            if not call:
-                return
-            
-            # Calculate mood using GPT
-            mood_data = await openai_service.calculate_mood_score(transcript_text)
-            
-            # Update call record
-            call.mood_score = mood_data.get("score", 5.0)
-            call.sentiment = mood_data.get("sentiment", "neutral")
-            call.tags = mood_data.get("emotions", [])
-            
-            await db.commit()
-            
-            print(f"✅ Mood score for call {call_id}: {call.mood_score}")
-            
-            # Check if we need to schedule a check-in
-            if call.mood_score < settings.mood_negative_threshold:
-                await schedule_checkin(call, mood_data)
-            
-        except Exception as e:
-            print(f"Error calculating mood: {e}")
-            await db.rollback()
+    digest = hashlib.sha256(transcript_text.encode()).hexdigest()
+    key = f"call_analysis:{settings.openai_analysis_model}:{ANALYSIS_PROMPT_VERSION}:{digest}"
+    cached = await get_redis_client().get_value(key)
+    if cached:
+        return orjson.loads(cached)
+    
+    # Bounded across calls so a burst of hang-ups doesn't fan out into
+    # more concurrent OpenAI requests than the rate limit allows
+    async with analysis_semaphore:
+        analysis = await openai_service.analyze_transcript(transcript_text)
+    
+    await get_redis_client().set_value(key, orjson.dumps(analysis).decode(), expiry=CALL_ANALYSIS_TTL)
+    return analysis
 
 
-async def schedule_checkin(call: Call, mood_data: Dict):
+async def store_entities(db: AsyncSession, call: Call, extracted: Dict):
     """
-    Schedule a check-in for a user based on low mood score
+    Store extracted entities and relations (caller commits)
     """
-    async with AsyncSessionLocal() as db:
-        try:
-            # Calculate check-in time (default: 24 hours later)
-            checkin_time = datetime.utcnow() + timedelta(hours=settings.checkin_delay_hours)
-            
-            # Create check-in record
-            checkin = CheckIn(
-                user_id=call.user_id,
-                call_id=call.id,
-                scheduled_time=checkin_time,
-                reason=f"Low mood detected (score: {call.mood_score}). Emotions: {', '.join(mood_data.get('emotions', []))}",
-                delivery_method="sms"  # Default to SMS
-            )
-            db.add(checkin)
-            await db.commit()
-            
-            # Also set flag in Redis for quick lookup
-            await redis_client.set_checkin_flag(
-                call.user_id,
-                {
-                    "checkin_id": checkin.id,
-                    "scheduled_time": checkin_time.isoformat(),
-                    "reason": checkin.reason
-                }
-            )
-            
-            print(f"✅ Scheduled check-in for user {call.user_id} at {checkin_time}")
-            
-        except Exception as e:
-            print(f"Error scheduling check-in: {e}")
-            await db.rollback()
+    # Per-entity traces are skipped entirely unless DEBUG is on
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug(
+            "📊 Extracted data for user %s: %d entities, %d relations",
+            call.user_id, len(extracted.get("entities", [])), len(extracted.get("relations", []))
+        )
+        for e in extracted.get("entities", []):
+            log.debug("  - Entity: %s (%s)", e.get("name"), e.get("type"))
+    
+    # One INSERT ... ON CONFLICT for every entity: new ones are created,
+    # ones the user already has get their mention count bumped. Repeats
+    # within this call are folded together first, since one statement
+    # can't touch the same row twice.
+    now = datetime.utcnow()
+    rows = {}  # (name, type) -> row
+    for entity_data in extracted.get("entities", []):
+        key = (entity_data["name"], entity_data["type"])
+        row = rows.get(key)
+        if row:
+            row["mention_count"] += 1
+            row["properties"] = entity_data.get("properties") or row["properties"]
+        else:
+            rows[key] = {
+                "user_id": call.user_id,
+                "name": entity_data["name"],
+                "entity_type": entity_data["type"],
+                # SQL NULL (not JSON null) so the COALESCE below falls through
+                "properties": entity_data.get("properties") or null(),
+                "mention_count": 1,
+                "last_mentioned": now
+            }
+    
+    entity_map = {}  # name -> entity_id
+    if rows:
+        stmt = upsert_insert(db, Entity).values(list(rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Entity.user_id, Entity.name, Entity.entity_type],
+            set_={
+                "mention_count": Entity.mention_count + stmt.excluded.mention_count,
+                "last_mentioned": stmt.excluded.last_mentioned,
+                # Keep the stored properties unless new ones were extracted
+                "properties": func.coalesce(stmt.excluded.properties, Entity.properties)
+            }
+        ).returning(Entity.id, Entity.name)
+        result = await db.execute(stmt)
+        entity_map = {row.name: row.id for row in result}
+        if debug:
+            log.debug("  ↻ Upserted %d entities", len(entity_map))
+    
+    # Store relations between entities we have ids for (one executemany
+    # INSERT; no ORM objects needed)
+    relations = [
+        r for r in extracted.get("relations", [])
+        if r.get("entity1") in entity_map and r.get("entity2") in entity_map
+    ]
+    relation_rows = [
+        {
+            "call_id": call.id,
+            "entity1_id": entity_map[r["entity1"]],
+            "entity2_id": entity_map[r["entity2"]],
+            "relation_type": r["relation_type"],
+            "context": r.get("context", "")
+        }
+        for r in relations
+    ]
+    if debug:
+        for r in relations:
+            log.debug("  🔗 Added relation: %s -%s-> %s", r["entity1"], r["relation_type"], r["entity2"])
+    if relation_rows:
+        await db.execute(insert(Relation), relation_rows)
+    relations_added = len(relation_rows)
+    
+    log.info("✅ Entity extraction complete for call %s: %d entities, %d relations", call.id, len(entity_map), relations_added)
 
 
-async def generate_call_title(call_id: int, transcript_text: str):
+async def store_mood(db: AsyncSession, call: Call, mood_data: Dict) -> Optional[CheckIn]:
     """
-    Generate a short, descriptive title for the call using GPT
+    Update the call's mood fields, scheduling a check-in if it's low (caller commits)
+    
+    Returns:
+        The new CheckIn, or None
     """
-    async with AsyncSessionLocal() as db:
-        try:
-            # Get call
-            result = await db.execute(
-                select(Call).where(Call.id == call_id)
-            )
-            call = result.scalar_one_or_none()
-            
-            if not call:
-                return
-            
-            # Generate title using GPT
-            prompt = f"""
-Generate a short, descriptive title (5-8 words max) for this diary conversation.
-The title should capture the main topic or emotion discussed.
-
-Examples of good titles:
-- "Stressed about work deadline"
-- "Excited about new promotion"
-- "Worried about relationship with Sarah"
-- "Feeling anxious about presentation"
-- "Happy about gym progress"
-- "Reflecting on family visit"
-
-Conversation:
-{transcript_text}
-
-Return ONLY the title, nothing else. No quotes, no punctuation at the end.
-"""
-            
-            title = await openai_service.generate_response(
-                transcript=prompt,
-                context=[],
-                mode="listener"
-            )
-            
-            # Clean up the title
-            title = title.strip().strip('"').strip("'").strip('.')
-            
-            # Limit length
-            if len(title) > 80:
-                title = title[:77] + "..."
-            
-            call.summary = title
-            await db.commit()
-            
-            print(f"✅ Generated title for call {call_id}: '{title}'")
-            
-        except Exception as e:
-            print(f"❌ Error generating title: {e}")
-            await db.rollback()
+    call.mood_score = mood_data.get("score", 5.0)
+    call.sentiment = mood_data.get("sentiment", "neutral")
+    call.tags = mood_data.get("emotions", [])
+    
+    log.info("✅ Mood score for call %s: %s", call.id, call.mood_score)
+    
+    # Check if we need to schedule a check-in
+    if call.mood_score < settings.mood_negative_threshold:
+        return await schedule_checkin(db, call, mood_data)
+    return None
+
 
+async def schedule_checkin(db: AsyncSession, call: Call, mood_data: Dict) -> CheckIn:
+    """
+    Schedule a check-in for a user based on low mood score (caller commits)
+    """
+    # Calculate check-in time (default: 24 hours later)
+    checkin_time = datetime.utcnow() + timedelta(hours=settings.checkin_delay_hours)
+    
+    # Create check-in record
+    checkin = CheckIn(
+        user_id=call.user_id,
+        call_id=call.id,
+        scheduled_time=checkin_time,
+        reason=f"Low mood detected (score: {call.mood_score}). Emotions: {', '.join(mood_data.get('emotions', []))}",
+        delivery_method="sms"  # Default to SMS
+    )
+    db.add(checkin)
+    await db.flush()
+    
+    log.info("✅ Scheduled check-in for user %s at %s", call.user_id, checkin_time)
+    return checkin
+
+
+def clean_call_title(title: str) -> str:
+    """Strip quotes and trailing punctuation from a GPT title and cap its length"""
+    title = title.strip().strip('"').strip("'").strip('.')
+    
+    # Limit length
+    if len(title) > 80:
+        title = title[:77] + "..."
+    
+    return title
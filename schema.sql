@@ -12,8 +12,6 @@ CREATE TABLE IF NOT EXISTS users (
     baseline_mood REAL DEFAULT 5.0
 );
 
-CREATE INDEX idx_users_phone ON users(phone_number);
-
 -- Calls table
 CREATE TABLE IF NOT EXISTS calls (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -33,7 +31,7 @@ CREATE TABLE IF NOT EXISTS calls (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
-CREATE INDEX idx_calls_user ON calls(user_id);
+CREATE INDEX idx_calls_user_time ON calls(user_id, start_time DESC);
 CREATE INDEX idx_calls_sid ON calls(call_sid);
 CREATE INDEX idx_calls_time ON calls(start_time DESC);
 
@@ -49,7 +47,7 @@ CREATE TABLE IF NOT EXISTS transcripts (
     FOREIGN KEY (call_id) REFERENCES calls(id) ON DELETE CASCADE
 );
 
-CREATE INDEX idx_transcripts_call ON transcripts(call_id);
+CREATE INDEX idx_transcripts_call_time ON transcripts(call_id, timestamp);
 CREATE INDEX idx_transcripts_time ON transcripts(timestamp);
 
 -- Entities table (Knowledge Graph nodes)
@@ -94,7 +92,7 @@ CREATE TABLE IF NOT EXISTS checkins (
     call_id INTEGER,
     scheduled_time DATETIME NOT NULL,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    status TEXT DEFAULT 'pending',  -- pending, completed, failed, cancelled
+    status TEXT DEFAULT 'pending',  -- pending, processing, completed, failed, cancelled
     completed_at DATETIME,
     reason TEXT,
     message TEXT,
@@ -108,6 +106,7 @@ CREATE TABLE IF NOT EXISTS checkins (
 CREATE INDEX idx_checkins_user ON checkins(user_id);
 CREATE INDEX idx_checkins_status ON checkins(status);
 CREATE INDEX idx_checkins_scheduled ON checkins(scheduled_time);
+CREATE INDEX idx_checkins_pending_due ON checkins(scheduled_time) WHERE status = 'pending';
 
 -- Insert default test user (optional)
 -- INSERT INTO users (phone_number, name, preferred_mode) 